@@ -207,14 +207,14 @@ ICACHE_RAM_ATTR void door_detect(){
   String topic = build_topic("interrupt");
   String content = 
   "{"
-    "'thing_id': '{{thing_id}}',"
-    "'thing_name': '{{thing_name}}',"
-    "'interrupt': "
+    "\"thing_id\": \"{{thing_id}}\","
+    "\"thing_name\": \"{{thing_name}}\","
+    "\"interrupt\": "
         "{"
-          "'sensor_name': '{{magnet_name}}',"
-          "'sensor_type': 'magnet',"
-          "'sensor_pin': {{magnet_pin}},"
-          "'sensor_value': {{magnet}}"
+          "\"sensor_name\": \"{{magnet_name}}\","
+          "\"sensor_type\": \"magnet\","
+          "\"sensor_pin\": {{magnet_pin}},"
+          "\"sensor_value\": {{magnet}}"
         "}"
   "}";
   int val_magnet = magnet();
@@ -235,14 +235,14 @@ ICACHE_RAM_ATTR void motion_detect(){
   String topic = build_topic("interrupt");
   String content = 
   "{"
-    "'thing_id': '{{thing_id}}',"
-    "'thing_name': '{{thing_name}}',"
-    "'interrupt': "
+    "\"thing_id\": \"{{thing_id}}\","
+    "\"thing_name\": \"{{thing_name}}\","
+    "\"interrupt\": "
         "{"
-          "'sensor_name': '{{motion_name}}',"
-          "'sensor_type': 'motion',"
-          "'sensor_pin': {{motion_pin}},"
-          "'sensor_value': {{motion}}"
+          "\"sensor_name\": \"{{motion_name}}\","
+          "\"sensor_type\": \"motion\","
+          "\"sensor_pin\": {{motion_pin}},"
+          "\"sensor_value\": {{motion}}"
         "}"
   "}";
   int val_motion = motion();
@@ -357,34 +357,34 @@ void send_status(String request_id){
   String topic = build_topic("response");
   String content = 
   "{"
-    "'request_id': '{{request_id}}',"
-    "'thing_id': '{{thing_id}}',"
-    "'thing_name': '{{thing_name}}',"
-    "'response': "
+    "\"request_id\": \"{{request_id}}\","
+    "\"thing_id\": \"{{thing_id}}\","
+    "\"thing_name\": \"{{thing_name}}\","
+    "\"response\": "
       "["
         "{"
-          "'sensor_name': '{{dht_name}}',"
-          "'sensor_type': 'temperature',"
-          "'sensor_pin': {{dht_pin}},"
-          "'sensor_value': {{temp}}"
+          "\"sensor_name\": \"{{dht_name}}\","
+          "\"sensor_type\": \"temperature\","
+          "\"sensor_pin\": {{dht_pin}},"
+          "\"sensor_value\": {{temp}}"
         "},"
         "{"
-          "'sensor_name': '{{dht_name}}',"
-          "'sensor_type': 'humidity',"
-          "'sensor_pin': {{dht_pin}},"
-          "'sensor_value': {{humid}}"
+          "\"sensor_name\": \"{{dht_name}}\","
+          "\"sensor_type\": \"humidity\","
+          "\"sensor_pin\": {{dht_pin}},"
+          "\"sensor_value\": {{humid}}"
         "},"
         "{"
-          "'sensor_name': '{{magnet_name}}',"
-          "'sensor_type': 'magnet',"
-          "'sensor_pin': {{magnet_pin}},"
-          "'sensor_value': {{magnet}}"
+          "\"sensor_name\": \"{{magnet_name}}\","
+          "\"sensor_type\": \"magnet\","
+          "\"sensor_pin\": {{magnet_pin}},"
+          "\"sensor_value\": {{magnet}}"
         "},"
         "{"
-          "'sensor_name': '{{motion_name}}',"
-          "'sensor_type': 'motion',"
-          "'sensor_pin': {{motion_pin}},"
-          "'sensor_value': {{motion}}"
+          "\"sensor_name\": \"{{motion_name}}\","
+          "\"sensor_type\": \"motion\","
+          "\"sensor_pin\": {{motion_pin}},"
+          "\"sensor_value\": {{motion}}"
         "}"
       "]"
   "}";
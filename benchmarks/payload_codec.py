@@ -0,0 +1,44 @@
+"""MQTT payload size and encode/decode time: str(dict) with quote replacement vs the payload codecs.
+
+Run from the repository root: python -m benchmarks.payload_codec
+"""
+import json
+import timeit
+
+from modules.payload_manager import encode, decode, msgpack
+
+RESPONSE = {
+    'request_id': '5f0c1e7ad3a44b52b1f0f2c6a1d4e9b7',
+    'thing_id': '234541114',
+    'response': [{'sensor_name': 'sensor{}'.format(i), 'sensor_type': 'temperature', 'sensor_pin': i,
+                  'sensor_value': 20 + i} for i in range(9)]
+}
+
+
+def legacy_encode(payload):
+    return str(payload).encode('utf-8')
+
+
+def legacy_decode(data):
+    return json.loads(data.decode('utf-8').replace("'", "\""))
+
+
+def main(number=20000):
+    codecs = [('str(dict)', legacy_encode, legacy_decode),
+              ('json', lambda payload: encode(payload, 'json'), decode)]
+    if msgpack is not None:
+        codecs.append(('msgpack', lambda payload: encode(payload, 'msgpack'), decode))
+    else:
+        print('msgpack not installed, skipping the binary codec')
+
+    print('{:10} {:>8} {:>12} {:>12}'.format('codec', 'bytes', 'encode us', 'decode us'))
+    for name, encoder, decoder in codecs:
+        data = encoder(RESPONSE)
+        assert decoder(data) == RESPONSE
+        encoding = timeit.timeit(lambda: encoder(RESPONSE), number=number) / number
+        decoding = timeit.timeit(lambda: decoder(data), number=number) / number
+        print('{:10} {:8d} {:12.2f} {:12.2f}'.format(name, len(data), encoding * 1e6, decoding * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Queue add/get throughput: the list based Queue vs the deque based Queue, single threaded.
+
+The new Queue is slower than the list Queue for short queues, FIFO up to about 10k queued events and LIFO up to a
+few thousand: it takes a lock on every add and get, the list Queue took none. Past that, list.pop(0) and insert(0)
+are O(n) and the deque based Queue wins. Run the script for the numbers on a given machine.
+
+Run from the repository root: python -m benchmarks.queue_ops
+"""
+import timeit
+
+from modules.miscellaneous import Queue
+
+
+class List_Queue:
+    """The previous list based Queue. LIFO add and every get are O(n)."""
+
+    def __init__(self, style):
+        self.queue = []
+        self.style = style
+
+    def add(self, element):
+        if self.style == 'FIFO':
+            self.queue.append(element)
+        elif self.style == 'LIFO':
+            self.queue.insert(0, element)
+
+    def get(self):
+        if len(self.queue) > 0:
+            return self.queue.pop(0)
+
+
+def fill_and_empty(queue, n):
+    for i in range(n):
+        queue.add(i)
+    for _ in range(n):
+        queue.get()
+
+
+def main(sizes=(1000, 10000, 50000), number=3, repeat=5):
+    print('{:6} {:>8} {:>12} {:>12} {:>8}'.format('style', 'events', 'list ms', 'deque ms', 'speedup'))
+    for style in ('FIFO', 'LIFO'):
+        for n in sizes:  # Best of repeat runs
+            legacy = min(timeit.repeat(lambda: fill_and_empty(List_Queue(style), n), number=number,
+                                       repeat=repeat)) / number
+            current = min(timeit.repeat(lambda: fill_and_empty(Queue(style), n), number=number,
+                                        repeat=repeat)) / number
+            print('{:6} {:8d} {:12.2f} {:12.2f} {:7.1f}x'.format(style, n, legacy * 1e3, current * 1e3,
+                                                                 legacy / current))
+
+    n = sizes[-1]
+    queue = Queue('PRIORITY')
+    drained = timeit.timeit(lambda: ([queue.add(i, priority=-i) for i in range(n)], queue.drain()), number=1)
+    print('PRIORITY {} events added and drained in {:.2f} ms'.format(n, drained * 1e3))
+
+
+if __name__ == '__main__':
+    main()
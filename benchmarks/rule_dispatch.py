@@ -0,0 +1,125 @@
+"""Interrupt-to-command latency: DataFrame queries per event vs the compiled Rule_Engine.
+
+Both paths are timed from the interrupt to the hand off of the rule commands to the executor: rule lookup,
+condition checks against the room status and the timer of the second command. Running the commands is not timed.
+
+Run from the repository root: python -m benchmarks.rule_dispatch
+"""
+import timeit
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Timer
+
+import pandas as pd
+
+from modules.commands_manager import Command, Rule_Engine
+from modules.scheduler_manager import Scheduler
+from modules.status_manager import Status_Store
+
+SENSORS = ['motion', 'magnet', 'LDR', 'temperature', 'humidity']
+
+
+def build_tables(n_rules=50):
+    """Synthetic rules, conditions and commands tables shaped like the MySQL ones."""
+
+    rules, conditions, commands = [], [], []
+    for i in range(n_rules):
+        rules.append({'rule_id': i, 'rule_name': 'rule{}'.format(i), 'rule_sensor': SENSORS[i % len(SENSORS)],
+                      'rule_command': 'on{}'.format(i), 'rule_function': 'off{}'.format(i), 'rule_timer': 300})
+        conditions.append({'rule_id': i, 'condition_type': 'average', 'condition_check': 'LDR',
+                           'condition_logic': '<', 'condition_value': 500})
+        for name in ('on{}'.format(i), 'off{}'.format(i)):
+            commands.append({'command_name': name, 'command_type': 'hue', 'command_sensor': '1',
+                             'command_value': "{'on': true}"})
+
+    return pd.DataFrame(rules), pd.DataFrame(conditions), pd.DataFrame(commands)
+
+
+def build_status(n_things=10):
+    """Last known readings of a room, as a DataFrame and as a Status_Store."""
+
+    readings = {'thing{}'.format(i): [{'sensor_name': '{}{}'.format(sensor, i), 'sensor_type': sensor, 'sensor_pin': j,
+                                       'sensor_value': 100 * j + i} for j, sensor in enumerate(SENSORS)]
+                for i in range(n_things)}
+
+    store = Status_Store()
+    for thing_id in readings:
+        store.update(thing_id, readings[thing_id])
+    return pd.DataFrame([reading for thing in readings.values() for reading in thing]), store
+
+
+def legacy_check_conditions(conditions, status):
+    """Rule.check_conditions before the rule engine: one query and one thread per condition."""
+
+    results = []
+    with ThreadPoolExecutor() as executor:
+        futures = []
+        for condition in conditions:
+            column = 'sensor_name' if any(char.isdigit() for char in condition['condition_check']) else 'sensor_type'
+            data = status.query('{} == "{}"'.format(column, condition['condition_check']))
+            futures.append(executor.submit(lambda data, condition: eval('{}{}{}'.format(
+                data['sensor_value'].mean(), condition['condition_logic'], condition['condition_value'])),
+                data, condition))
+        for future in as_completed(futures):
+            results.append(future.result())
+    return all(results)
+
+
+def legacy_dispatch(sensor_type, rules, conditions, commands, status, timers, submit):
+    """The per-interrupt path of Main.execute and Main.process_rule before the rule engine."""
+
+    def process_rule(rule, cmd, condition):
+        if legacy_check_conditions(condition, status):
+            if rule['rule_sensor'] in timers:
+                timers[rule['rule_sensor']].cancel()
+            timers[rule['rule_sensor']] = Timer(interval=rule['rule_timer'], function=submit, args=[cmd[1]])
+            timers[rule['rule_sensor']].start()
+            submit(cmd[0])
+
+    data = rules.query('rule_sensor == "{}"'.format(sensor_type)).to_dict(orient='records')
+    with ThreadPoolExecutor() as executor:
+        futures = []
+        for rule in data:
+            cmd = tuple(Command(commands.query('command_name == "{}"'.format(name)).to_dict(orient='records')[0])
+                        for name in (rule['rule_command'], rule['rule_function']))
+            condition = conditions.query('rule_id == {}'.format(rule['rule_id'])).to_dict(orient='records')
+            futures.append(executor.submit(process_rule, rule, cmd, condition))
+        for future in as_completed(futures):
+            future.result()
+
+
+def engine_dispatch(sensor_type, engine, status, timers, submit):
+    """The per-interrupt path of Main.execute and Main.process_rule with the rule engine."""
+
+    for rule in engine.evaluate(engine.match(sensor_type), status):
+        if rule.rule_timer > 0 and rule.commands[1] is not None:
+            timers.schedule(key=('room', rule.rule_id), delay=rule.rule_timer, function=submit,
+                            args=[rule.commands[1]], payload={'device_id': 'room',
+                                                              'command_name': rule.commands[1].command_name})
+        submit(rule.commands[0])
+
+
+def main(number=200):
+    rules, conditions, commands = build_tables()
+    frame, store = build_status()
+    engine = Rule_Engine(rules, conditions, commands)
+    submitted = []  # Stands in for Command_Executor.submit, the commands are not run
+
+    legacy_timers, timers = dict(), Scheduler()  # The Scheduler thread is not started, nothing comes due
+    legacy = timeit.timeit(lambda: legacy_dispatch('motion', rules, conditions, commands, frame, legacy_timers,
+                                                   submitted.append), number=number) / number
+    for timer in legacy_timers.values():
+        timer.cancel()
+    legacy_sent, submitted[:] = len(submitted), []
+
+    compiled = timeit.timeit(lambda: engine_dispatch('motion', engine, store, timers, submitted.append),
+                             number=number) / number
+
+    print('Rules: {} | Rules per interrupt: {} | Commands sent: {} legacy, {} engine'.format(
+        len(rules), len(engine.match('motion')), legacy_sent // number, len(submitted) // number))
+    print('DataFrame queries: {:10.1f} us per interrupt'.format(legacy * 1e6))
+    print('Rule_Engine:       {:10.1f} us per interrupt'.format(compiled * 1e6))
+    print('Speed up:          {:10.0f}x'.format(legacy / compiled))
+
+
+if __name__ == '__main__':
+    main()
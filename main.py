@@ -1,13 +1,17 @@
 import pandas as pd
 from modules.home_manager import Home
-from config.configurations import house_id
+from modules.async_manager import Async_Runtime
+from config.configurations import house_id, runtime
 
 
 def main():
     print('Starting SmartHome_v2')
     home = Home(house_id)
-    home.start()
-    print(home.get_status())
+    if runtime == 'asyncio':
+        Async_Runtime(home).run()
+    else:
+        home.start()
+        print(home.get_status())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,101 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.home_manager import Main
+from modules.scheduler_manager import Async_Scheduler
+from config.configurations import control, scheduler
+
+
+class Async_Runtime:
+    """Runs a whole Home on one asyncio event loop instead of thread-per-node.
+
+    MQTT I/O, request correlation, rule evaluation, timers, history flushes and the rule poller run on the loop.
+    Main.execute and process_rule keep their semantics. Requests, phue, SoCo and pyttsx3 are blocking libraries with
+    no asyncio clients in this project, so these threads remain:
+
+        Command_Executor : commands run on its worker threads, one serial lane per device, as in the threaded runtime
+        Hue : the state sender and group refresh threads of each bridge
+        Sonos : the announcement and playlist refresh threads of each speaker
+        default executor : workers threads for database queries, history writes, reloads and MQTT reconnects
+
+    Attributes
+    ----------
+    home : object
+        Object of type Home, built but not started
+
+    loop : object
+        The asyncio event loop, set by run()
+
+    Parameters
+    ----------
+    home : object
+        Object of type Home
+
+    workers : int
+        Size of the executor used for blocking third-party and database calls
+
+    """
+
+    def __init__(self, home, workers=4):
+        self.home = home
+        self.workers = workers
+        self.loop = None
+
+    def run(self):
+        """Run the home until interrupted."""
+        asyncio.run(self.main())
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop.set_default_executor(ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='blocking'))
+        self.home.mosquitto.router.attach(self.loop)  # Shared by every node and the control channel
+
+        timers = Async_Scheduler(self.loop, **scheduler)
+        for node in self.home.walk():
+            node.loop = self.loop
+            node.timers = timers
+            Main.initialize(node)  # MQTT routes and third-party clients, without Home's service threads
+
+        print(self.home.control.listen([control['reload']]))
+        self.home.presence.start(self.loop)
+        timers.start()
+        print('Restored {} timers'.format(timers.restore(self.home.restore_timer)))
+
+        tasks = [self.loop.create_task(self.flush_history())]
+        if control['poll']:
+            tasks.append(self.loop.create_task(self.watch()))
+        await asyncio.gather(*tasks)
+
+    async def flush_history(self):
+        """Flush sensor history on its interval and apply retention once an hour, on the executor."""
+        while True:
+            await asyncio.sleep(self.home.history.interval)
+            try:
+                await self.loop.run_in_executor(None, self.home.history.maintain)
+            except Exception as error:  # Keep recording, the batch is retried next time
+                print('History flush failed: {}'.format(error))
+
+    async def watch(self):
+        """Poll the version query and reload when it changes."""
+        version = None
+        while True:
+            try:
+                current = await self.loop.run_in_executor(None, self.home.database.query, control['version_query'])
+                current = current.to_dict(orient='records')[0]
+            except Exception as error:  # i.e. tables without an updated_at column
+                print('Stopped watching for rule changes: {}'.format(error))
+                return
+
+            if version is not None and current != version:
+                try:
+                    await self.loop.run_in_executor(None, self.home.reload)
+                except Exception as error:  # Keep the rules in use and try again on the next poll
+                    print('Could not reload rules: {}'.format(error))
+                    await asyncio.sleep(control['poll'])
+                    continue
+            version = current
+            await asyncio.sleep(control['poll'])
+
+    async def get_status(self, current=True):
+        """Status of the whole home. Every thing is awaited concurrently."""
+        return await self.home.async_get_status(current)
@@ -1,31 +1,58 @@
-import json
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import operator
 from datetime import datetime
-from threading import Timer
 
+import numpy as np
 import pandas as pd
 
 
+OPERATORS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+AGGREGATIONS = {
+    'sum': np.sum,
+    'average': np.mean,
+    'min': np.min,
+    'max': np.max,
+    'count': np.count_nonzero,
+}
+
+
+def to_minutes(value):
+    """Convert a HH:MM string to minutes since midnight."""
+
+    hours, minutes = str(value).strip().split(':')
+    return int(hours) * 60 + int(minutes)
+
+
 class Condition:
     """Represents a single condition to a rule.
 
+    The condition is compiled into a closure when the rule is loaded, so checking it is a single function call
+    with no string parsing or eval().
+
     Attributes
     -----------
     rule_id : int
         Primary record ID in Database for condition
 
     condition_type : str
-        Type of condition i.e average, sum, max, min
+        Type of condition i.e sum, average, min, max, count, any, all, time
 
     condition_check: str
         Type of sensors or specific sensor. i.e. LDR, LDR1, lights, motion, motion2
 
     condition_logic : str
-        Type of logic to apply condition. i.e. <, <=, >, >=, etc...
+        Type of logic to apply condition. i.e. <, <=, >, >=, ==, != or between (time only)
 
     condition_value : int
-        Condition threshold to test live values.
-        
+        Condition threshold to test live values. Time conditions use HH:MM, or HH:MM-HH:MM for between.
+        A between window whose start is after its end spans midnight, i.e. 22:00-06:00
 
     Parameters
     ----------
@@ -40,43 +67,120 @@ class Condition:
         self.condition_check = data['condition_check']
         self.condition_logic = data['condition_logic']
         self.condition_value = data['condition_value']
+        self.evaluate = self.compile()
+
+    def compile(self):
+        """Build the function that checks this condition. Raises ValueError for unsupported conditions."""
+
+        if self.condition_type == 'time':
+            return self.compile_time()
+
+        if self.condition_logic not in OPERATORS:
+            raise ValueError('Unsupported condition logic {}'.format(self.condition_logic))
+
+        compare = OPERATORS[self.condition_logic]
+        threshold = float(self.condition_value)
+
+        if self.condition_type in ('any', 'all'):  # Compare each reading, then reduce
+            reduce = np.any if self.condition_type == 'any' else np.all
+
+            def evaluate(values):
+                return values.size > 0 and bool(reduce(compare(values, threshold)))
+
+        elif self.condition_type in AGGREGATIONS:
+            aggregate = AGGREGATIONS[self.condition_type]
+            empty = bool(compare(0, threshold)) if self.condition_type in ('sum', 'count') else False
+
+            def evaluate(values):
+                values = values[~np.isnan(values)]  # Unreadable sensors are skipped, as pandas does
+                if values.size == 0:  # No readings, only sum and count are defined
+                    return empty
+                return bool(compare(aggregate(values), threshold))
+
+        else:
+            raise ValueError('Unsupported condition type {}'.format(self.condition_type))
+
+        return evaluate
+
+    def compile_time(self):
+        """Build the function that checks the current time against the condition."""
+
+        if self.condition_logic == 'between':
+            start, end = (to_minutes(value) for value in str(self.condition_value).split('-'))
+
+            if start <= end:
+                def inside(minute):
+                    return start <= minute < end
+            else:  # Window spans midnight
+                def inside(minute):
+                    return minute >= start or minute < end
+
+        elif self.condition_logic in OPERATORS:
+            compare = OPERATORS[self.condition_logic]
+            threshold = to_minutes(self.condition_value)
+
+            def inside(minute):
+                return compare(minute, threshold)
+
+        else:
+            raise ValueError('Unsupported condition logic {}'.format(self.condition_logic))
+
+        def evaluate(values=None):
+            now = datetime.now()
+            return inside(now.hour * 60 + now.minute)
+
+        return evaluate
 
     def condition_met(self, data):
         """Checks if condition is met. Returns True if met, False if not.
 
         Parameters
         ----------
-        data : DataFrame
-            Pandas data frame containing the filtered data for condition.
+        data : DataFrame or ndarray
+            Pandas data frame containing the filtered data for condition, or an array of its sensor values.
         """
 
-        if self.condition_type == 'sum':  # Check sum
-            return eval('{}{}{}'.format(data['sensor_value'].sum(), self.condition_logic, self.condition_value))
+        if isinstance(data, pd.DataFrame):
+            data = data['sensor_value']
 
-        elif self.condition_type == 'average':  # Check mean
-            return eval('{}{}{}'.format(data['sensor_value'].mean(), self.condition_logic, self.condition_value))
+        return self.evaluate(np.asarray(data, dtype=float))
 
-        elif self.condition_type == 'time':  # Check time constraints
-            now = datetime.now()  # initialize datetime now variable
-            current_time = now.strftime("%H:%M")  # reformat current time
 
-            if self.condition_logic == '>':  # Check constraints
-                return current_time > self.condition_value
+class Snapshot:
+    """Sensor status split into NumPy columns. Each condition_check key is filtered at most once.
 
-            elif self.condition_logic == '>=':
-                return current_time >= self.condition_value
+    Attributes
+    ----------
+    values : ndarray
+        Array of every sensor value
 
-            elif self.condition_logic == '<':
-                return current_time < self.condition_value
+    columns : dict
+        Dictionary defined as {condition_check: ndarray}
 
-            elif self.condition_logic == '<=':
-                return current_time <= self.condition_value
+    Parameters
+    ----------
+    status : DataFrame
+        Pandas data frame of all current sensors in room
 
-            elif self.condition_logic == '==':
-                return current_time == self.condition_value
+    """
+
+    def __init__(self, status):
+        self.values = pd.to_numeric(status['sensor_value'], errors='coerce').to_numpy(dtype=float)
+        self.sensor_name = status['sensor_name'].to_numpy()
+        self.sensor_type = status['sensor_type'].to_numpy()
+        self.columns = dict()
 
-            elif self.condition_logic == '!=':
-                return current_time != self.condition_value
+    def column(self, condition_check):
+        """Returns the values for a specific sensor (name with digits) or a type of sensor."""
+
+        values = self.columns.get(condition_check)
+        if values is None:
+            if any(char.isdigit() for char in condition_check):
+                values = self.values[self.sensor_name == condition_check]
+            else:
+                values = self.values[self.sensor_type == condition_check]
+            self.columns[condition_check] = values
+        return values
 
 
 class Rule:
@@ -128,39 +232,23 @@ class Rule:
         self.rule_timer = data['rule_timer']
         self.rule_sensor = data['rule_sensor']
         self.conditions = [Condition(condition) for condition in conditions]
+        self.source = None  # Source rows, used by Rule_Engine to detect changes on reload
 
     def check_conditions(self, status):
-        """Simultaneously check all conditions in rule.
+        """Check the conditions in order and stop at the first one that fails.
 
         Parameters
         ----------
-        status : DataFrame
-            Pandas data frame of all current sensors in room
+        status : DataFrame, Snapshot or Status_Store
+            Sensor status of the room. Anything with a column(condition_check) method is used as is
 
         """
-        if not status.empty:
-            conditions_check = []  # Initialize empty condition list
-            results = []  # Initialize empty result list
-            with ThreadPoolExecutor() as executor:  # Begin sub-threads
-                for condition in self.conditions:  # iterate through each condition
-
-                    if any(char.isdigit() for char in condition.condition_check):
-                        data = status.query('sensor_name == "{}"'.format(condition.condition_check))  # filter status data
+        if isinstance(status, pd.DataFrame):
+            if status.empty:
+                return False
+            status = Snapshot(status)
 
-                    else:
-                        data = status.query('sensor_type == "{}"'.format(condition.condition_check))  # filter status data
-
-                    conditions_check.append(executor.submit(condition.condition_met, data=data))  # submit to thread pool
-
-                for result in as_completed(conditions_check):  # Wait until all conditions have finished
-                    results.append(result.result())  # Append result to result list
-
-                if [True] * len(results) == results:  # If all conditions are met, return True
-                    return True
-                else:
-                    return False
-        else:
-            return False
+        return all(condition.evaluate(status.column(condition.condition_check)) for condition in self.conditions)
 
     def __repr__(self):
         """Canonical string representation of rule."""
@@ -222,3 +310,126 @@ class Command:
         """Canonical string representation of command."""
 
         return '{} | {} | {} | {}'.format(self.command_name, self.command_type, self.command_sensor, self.command_value)
+
+
+class Rule_Engine:
+    """Rules, conditions and commands of a single device, compiled once at load.
+
+    Interrupts are dispatched with a dictionary lookup instead of querying the tables and rebuilding objects.
+
+    Attributes
+    ----------
+    rules : dict
+        Dictionary defined as {rule_sensor: tuple of Rule}
+
+    commands : dict
+        Dictionary defined as {command_name: Command}
+
+    Parameters
+    ----------
+    rules : DataFrame
+        Pandas data frame of the rules table
+
+    conditions : DataFrame
+        Pandas data frame of the conditions table
+
+    commands : DataFrame
+        Pandas data frame of the commands table
+
+    """
+
+    def __init__(self, rules=None, conditions=None, commands=None):
+        self.rules = dict()
+        self.commands = dict()
+        if rules is not None:
+            self.compile(rules, conditions, commands)
+
+    def compile(self, rules, conditions, commands):
+        """Build the indexes from the tables and swap them in.
+
+        Rules and commands whose source rows did not change keep their compiled objects. Returns a dictionary
+        defined as {added, changed, removed, unchanged: number of rules}.
+        """
+
+        old_commands = self.commands
+        command_index = dict()
+        for data in commands.to_dict(orient='records'):
+            command = Command(data)
+            previous = old_commands.get(command.command_name)
+            command_index[command.command_name] = previous if repr(previous) == repr(command) else command
+
+        condition_index = dict()  # {rule_id: [condition data]}
+        if conditions is not None and not conditions.empty:
+            for data in conditions.to_dict(orient='records'):
+                condition_index.setdefault(data['rule_id'], []).append(data)
+
+        old_rules = {rule.rule_id: rule for sensor in self.rules for rule in self.rules[sensor]}
+        changes = {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 0}
+        rule_index = dict()  # {rule_sensor: [Rule]}
+        for data in rules.to_dict(orient='records'):
+            if data['rule_command'] not in command_index:
+                print('Skipping rule {}. Unknown command {}'.format(data['rule_name'], data['rule_command']))
+                continue
+
+            function = None
+            if data['rule_function'] not in (None, 'None'):
+                if data['rule_function'] not in command_index:
+                    print('Skipping rule {}. Unknown function {}'.format(data['rule_name'], data['rule_function']))
+                    continue
+                function = command_index[data['rule_function']]
+
+            commands = (command_index[data['rule_command']], function)
+            source = repr((sorted(data.items()), [sorted(condition.items()) for condition in
+                                                  condition_index.get(data['rule_id'], [])], commands))
+            previous = old_rules.pop(data['rule_id'], None)
+
+            if previous is not None and previous.source == source:  # Unchanged, keep the compiled rule
+                rule = previous
+                changes['unchanged'] += 1
+            else:
+                try:
+                    rule = Rule(data, commands, condition_index.get(data['rule_id'], []))
+                except ValueError as error:  # Bad condition rows only disable their own rule
+                    print('Skipping rule {}. {}'.format(data['rule_name'], error))
+                    continue
+                rule.source = source
+                changes['added' if previous is None else 'changed'] += 1
+
+            rule_index.setdefault(rule.rule_sensor, []).append(rule)
+
+        changes['removed'] = len(old_rules)
+        self.commands = command_index  # Replace references, readers never see a half-built index
+        self.rules = {sensor: tuple(rule_index[sensor]) for sensor in rule_index}
+        return changes
+
+    def evaluate(self, rules, status):
+        """Check every rule against one snapshot of the status. Returns the rules whose conditions are met.
+
+        Parameters
+        ----------
+        rules : iterable
+            Rules of type Rule, i.e. from match()
+
+        status : DataFrame or Status_Store
+            Sensor status of the room
+
+        """
+        if status.empty:
+            return []
+
+        if isinstance(status, pd.DataFrame):
+            status = Snapshot(status)  # Shared by every rule, each sensor key is filtered once
+        return [rule for rule in rules if rule.check_conditions(status)]
+
+    def match(self, sensor_type):
+        """Returns the rules triggered by a sensor type."""
+
+        return self.rules.get(sensor_type, ())
+
+    def command(self, command_name):
+        """Returns a compiled command by name."""
+
+        return self.commands.get(command_name)
+
+    def __repr__(self):
+        return '{} rules | {} commands'.format(sum(len(rules) for rules in self.rules.values()), len(self.commands))
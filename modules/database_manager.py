@@ -1,16 +1,145 @@
+import re
+import time
+from collections import OrderedDict
+from threading import Lock
+
 import sqlalchemy
 import pandas as pd
-from config.configurations import database
+from config.configurations import database, database_pool
+
+engines = dict()  # {url: engine}, one engine and connection pool per database in the process
+engines_lock = Lock()
+
+
+def get_engine(url, **pool):
+    """Returns the shared engine for a database url, creating it on first use."""
+
+    with engines_lock:
+        if url not in engines:
+            if url.startswith('sqlite'):  # SQLite has no server side pool to size
+                engines[url] = sqlalchemy.create_engine(url)
+            else:
+                engines[url] = sqlalchemy.create_engine(url, **pool)
+        return engines[url]
+
+
+class Query_Cache:
+    """LRU cache of query results that expire after ttl seconds.
+
+    Attributes
+    ----------
+    entries : OrderedDict
+        Dictionary defined as {(query, params): (expires, tables, DataFrame)}, least recently used first
+
+    Parameters
+    ----------
+    size : int
+        Maximum number of cached results
+
+    ttl : int
+        Seconds a result stays valid
+
+    """
+
+    def __init__(self, size=128, ttl=300):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    @staticmethod
+    def key(query, params):
+        return query, tuple(sorted((params or {}).items()))
+
+    def get(self, query, params=None):
+        """Returns a copy of the cached result, or None when missing or expired."""
+
+        key = self.key(query, params)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():  # Expired
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        return entry[2].copy()  # Callers may modify their frame
+
+    def set(self, query, params, result):
+        tables = set(re.findall(r'(?:from|join)\s+(\w+)', query, flags=re.IGNORECASE))
+        with self.lock:
+            self.entries[self.key(query, params)] = (time.monotonic() + self.ttl, tables, result.copy())
+            self.entries.move_to_end(self.key(query, params))
+            while len(self.entries) > self.size:  # Drop least recently used
+                self.entries.popitem(last=False)
+
+    def invalidate(self, table=None):
+        """Drop every cached result, or only those that read the given table. Returns the number dropped."""
+
+        with self.lock:
+            if table is None:
+                dropped = len(self.entries)
+                self.entries.clear()
+                return dropped
+
+            stale = [key for key, entry in self.entries.items() if table in entry[1]]
+            for key in stale:
+                del self.entries[key]
+            return len(stale)
+
+
+caches = dict()  # {url: Query_Cache}, shared like the engines
 
 
 class Database:
-    def __init__(self):
-        self.engine = sqlalchemy.create_engine(
-            'mysql+pymysql://{username}:{password}@{host_ip}:3306/{database}'.format(**database))
+    """Shared database access. Every instance with the same url uses the same engine, pool and result cache.
+
+    Parameters
+    ----------
+    url : str
+        SQLAlchemy database url. Defaults to the MySQL database in the configuration
+
+    """
+
+    def __init__(self, url=None):
+        if url is None:
+            url = 'mysql+pymysql://{username}:{password}@{host_ip}:3306/{database}'.format(**database)
+
+        self.engine = get_engine(url, **database_pool)
+        with engines_lock:
+            self.cache = caches.setdefault(url, Query_Cache())
+
+    def query(self, query, params=None, cache=False):
+        """Run a parameterized query and return a DataFrame.
+
+        Parameters
+        ----------
+        query : str
+            SQL with named parameters, i.e. 'select * from rooms where home_id = :home_id'
+
+        params : dict
+            Dictionary defined as {parameter_name: value}
+
+        cache : bool
+            Serve and store the result in the query cache. Meant for configuration tables
+
+        """
+        if cache:
+            result = self.cache.get(query, params)
+            if result is not None:
+                return result
+
+        result = pd.read_sql(sqlalchemy.text(query), self.engine, params=params)
+
+        if cache:
+            self.cache.set(query, params, result)
+        return result
 
-    def query(self, query):
-        return pd.read_sql(query, self.engine)
+    def invalidate(self, table=None):
+        """Drop cached results of a table, or all of them."""
+        return self.cache.invalidate(table)
 
     def insert(self, data, table):
-        data.to_sql(self.engine, table, if_exists='APPEND')
+        data.to_sql(table, self.engine, if_exists='append', index=False)
+        self.invalidate(table)
         return 'Inserted Data'
@@ -0,0 +1,119 @@
+import time
+from threading import Lock
+
+MODES = ('leading', 'trailing', 'both', 'none')
+
+
+class Debouncer:
+    """Coalesces bursts of interrupts before they reach rule evaluation.
+
+    Interrupts are grouped by sensor type, or by sensor name when that name has its own settings. The first interrupt
+    of a group opens a window of window seconds. What is passed on depends on the mode:
+
+        leading : the first interrupt right away, the rest of the window is dropped
+        trailing : the latest interrupt when the window closes
+        both : the first interrupt right away, and the latest one when the window closes if more arrived
+        none : every interrupt right away
+
+    Attributes
+    ----------
+    windows : dict
+        Dictionary defined as {sensor: [opened, latest interrupt not passed on yet]}, open windows
+
+    counters : dict
+        Dictionary defined as {received, passed, coalesced, held}. held counts interrupts waiting for their window
+        to close, so received = passed + coalesced + held
+
+    Parameters
+    ----------
+    callback : function
+        Called with an interrupt that passes
+    name : hashable
+        Unique name of the owner, i.e. the room's device_id. Used in scheduler keys
+    window : float
+        Default window in seconds
+    mode : str
+        Default mode
+    sensors : dict
+        Dictionary defined as {rule_sensor: {window, mode}}, settings per sensor type or sensor name
+
+    """
+
+    def __init__(self, callback, name, window=1, mode='both', sensors=None):
+        self.callback = callback
+        self.name = name
+        self.window = window
+        self.mode = mode
+        self.sensors = dict() if sensors is None else sensors
+        self.windows = dict()
+        self.counters = dict.fromkeys(['received', 'passed', 'coalesced', 'held'], 0)
+        self.lock = Lock()
+
+    def settings(self, interrupt):
+        """Returns (sensor, window, mode) of an interrupt."""
+
+        sensor = interrupt['sensor_name'] if interrupt.get('sensor_name') in self.sensors else interrupt['sensor_type']
+        settings = self.sensors.get(sensor, {})
+        return sensor, settings.get('window', self.window), settings.get('mode', self.mode)
+
+    def submit(self, interrupt, timers):
+        """Pass on or hold an interrupt.
+
+        Parameters
+        ----------
+        interrupt : dict
+            Dictionary defined as {sensor_name, sensor_type, sensor_pin, sensor_value}
+        timers : object
+            Object of type Scheduler, closes trailing windows
+
+        """
+
+        sensor, window, mode = self.settings(interrupt)
+        now = time.monotonic()
+        passed = False
+
+        with self.lock:
+            self.counters['received'] += 1
+            state = self.windows.get(sensor)
+
+            if mode == 'none' or window <= 0:
+                passed = True
+
+            elif state is None or (mode == 'leading' and now - state[0] >= window):  # Opens a window
+                passed = mode in ('leading', 'both')
+                self.windows[sensor] = [now, None if passed else interrupt]
+                self.counters['held'] += not passed
+                if mode in ('trailing', 'both'):
+                    timers.schedule(key=('debounce', self.name, sensor), delay=window, function=self.close,
+                                    args=[sensor])
+
+            else:  # Inside an open window
+                if mode == 'leading' or state[1] is not None:
+                    self.counters['coalesced'] += 1  # Dropped, or the held interrupt is replaced
+                else:
+                    self.counters['held'] += 1
+                if mode != 'leading':
+                    state[1] = interrupt
+
+            if passed:
+                self.counters['passed'] += 1
+
+        if passed:
+            self.callback(interrupt)
+        return passed
+
+    def close(self, sensor):
+        """Close a trailing window, passing on the latest interrupt held."""
+
+        with self.lock:
+            state = self.windows.pop(sensor, None)
+            interrupt = None if state is None else state[1]
+            if interrupt is not None:
+                self.counters['held'] -= 1
+                self.counters['passed'] += 1
+
+        if interrupt is not None:
+            self.callback(interrupt)
+
+    def __repr__(self):
+        return '{received} interrupts, {passed} passed, {coalesced} coalesced, {held} held'.format(**self.counters)
@@ -0,0 +1,317 @@
+import copy
+import json
+import time
+from concurrent.futures import Future
+from threading import Thread, Lock
+
+from modules.miscellaneous import Queue
+
+PRIORITIES = {'safety': 0, 'security': 1, 'comfort': 2, 'ambience': 3}  # Lower runs first
+
+HANDLERS = dict()  # {command_type: Handler}
+
+
+class Handler:
+    """A registered command handler.
+
+    Attributes
+    ----------
+    function : function
+        Called as function(third_party, command) on an executor thread
+
+    lane : function
+        Called as lane(command), returns the key of the device the command targets. Commands with the same key
+        run one at a time, in order
+
+    priority : str
+        Default priority class of the command type, see PRIORITIES
+
+    state : bool
+        Commands set a state, so a repeated command can be suppressed and a queued one replaced. False for actions
+        such as announcements, which always run
+
+    merge : function
+        Called as merge(queued command, new command), returns the command that replaces the queued one.
+        Defaults to the new command
+
+    normalize : function
+        Called as normalize(command_value), returns the value compared with the last applied one. Defaults to the
+        value itself
+
+    """
+
+    def __init__(self, command_type, function, lane, priority, state=True, merge=None, normalize=None):
+        self.command_type = command_type
+        self.function = function
+        self.lane = lane
+        self.priority = priority
+        self.state = state
+        self.merge = merge or (lambda queued, command: command)
+        self.normalize = normalize or (lambda value: value)
+
+
+def parse_state(value):
+    """Returns a JSON state as a dictionary, so "{'on': true}" and '{"on": true}' compare equal. Other values are
+    returned as they are."""
+
+    try:
+        state = json.loads(value.replace("'", "\""))
+    except (AttributeError, ValueError):  # Not a string, or not JSON
+        return value
+    return state if isinstance(state, dict) else value
+
+
+def merge_states(queued, command):
+    """Merge two JSON state commands, i.e. {"on": true} then {"bri": 50} gives {"on": true, "bri": 50}.
+
+    When either state is not a JSON object, the new command replaces the queued one.
+    """
+
+    state, update = parse_state(queued.command_value), parse_state(command.command_value)
+    if not isinstance(state, dict) or not isinstance(update, dict):
+        return command
+
+    merged = copy.copy(command)  # Compiled commands are shared, do not modify
+    merged.command_value = json.dumps(dict(state, **update))
+    return merged
+
+
+def handler(command_type, lane=None, priority='comfort', state=True, merge=None, normalize=None):
+    """Decorator that registers function(third_party, command) as the handler of a command type.
+
+    Parameters
+    ----------
+    command_type : str
+        Value of Command.command_type the handler runs, i.e. hue
+    lane : function
+        Returns the device key of a command. Defaults to (command_type, command_sensor)
+    priority : str
+        Priority class, see PRIORITIES
+    state : bool
+        False for commands that must never be suppressed or collapsed
+    merge : function
+        Combines a queued command with a newer one for the same target
+    normalize : function
+        Makes equal states compare equal when suppressing repeats
+
+    """
+
+    def register(function):
+        HANDLERS[command_type] = Handler(command_type, function,
+                                         lane or (lambda command: (command.command_type, command.command_sensor)),
+                                         priority, state, merge, normalize)
+        return function
+
+    return register
+
+
+@handler('hue', priority='ambience', merge=merge_states, normalize=parse_state)
+def hue_command(third_party, command):
+    """Phillips Hue. command_sensor is the group, command_value the state."""
+    if 'hue' in third_party:
+        value = command.command_value.replace("'", "\"")  # Compiled commands are shared, do not modify
+        third_party['hue'].queue_group(command.command_sensor, value)  # Rate limited, coalesced
+
+
+@handler('sonos', lane=lambda command: ('sonos',), priority='ambience', state=False)  # One speaker, one lane
+def sonos_command(third_party, command):
+    """Sonos. command_sensor is listen or speak."""
+    if command.command_sensor == 'listen' and command.command_value == 'random':
+        third_party['sonos'].listen()
+
+    elif command.command_sensor == 'listen':
+        third_party['sonos'].listen(command.command_value)
+
+    elif command.command_sensor == 'speak':
+        third_party['sonos'].announce(command.command_value, volume=10)  # Queued, does not block
+
+
+class Command_Executor:
+    """Runs commands on a pool of threads with one serial lane per target device.
+
+    Commands for the same device run one at a time in the order they were submitted, commands for different devices
+    run in parallel. Priority only chooses between lanes: when more lanes are ready than threads are free, the lane
+    holding the most urgent command goes first.
+
+    State commands are keyed by (command_type, command_sensor). A command identical to the last one applied to its
+    key within window seconds is suppressed, and a command arriving while another for the same key is still queued
+    is merged into it by the handler, so a burst sends one combined state. The merged command runs at the more
+    urgent of the two priorities. Handlers registered with state=False (i.e. announcements) always run.
+
+    Attributes
+    ----------
+    lanes : dict
+        Dictionary defined as {lane key: Queue of jobs}, FIFO style
+
+    ready : object
+        Object of type Queue, lane keys waiting for a thread. PRIORITY style, by the most urgent job of the lane
+
+    metrics : dict
+        Dictionary defined as {command_type: {count, errors, run, run_max, wait}}. Times are total seconds
+
+    applied : dict
+        Dictionary defined as {(command_type, command_sensor): (normalized command_value, time applied)}
+
+    counters : dict
+        Dictionary defined as {sent, suppressed, collapsed}
+
+    Parameters
+    ----------
+    workers : int
+        Number of threads running commands
+
+    priorities : dict
+        Dictionary defined as {command_type or command_name: priority class}, overrides the handler's default
+
+    window : int
+        Seconds an identical command is suppressed after it was applied, 0 to send every command
+
+    collapse : bool
+        Merge a newer command into the queued one for the same key
+
+    """
+
+    def __init__(self, workers=4, priorities=None, window=30, collapse=True):
+        self.workers = workers
+        self.priorities = dict() if priorities is None else priorities
+        self.lanes = dict()
+        self.active = set()  # Lanes queued in ready or running
+        self.ready = Queue('PRIORITY')
+        self.metrics = dict()
+        self.window = window
+        self.collapse = collapse
+        self.applied = dict()
+        self.waiting = dict()  # {(command_type, command_sensor): queued job}
+        self.counters = dict.fromkeys(['sent', 'suppressed', 'collapsed'], 0)
+        self.lock = Lock()
+        self.threads = []
+
+    def start(self):
+        if not self.threads:
+            self.threads = [Thread(target=self.run, name='command-{}'.format(i), daemon=True)
+                            for i in range(self.workers)]
+            for thread in self.threads:
+                thread.start()
+        return self
+
+    def priority(self, command, handler):
+        name = self.priorities.get(command.command_name, self.priorities.get(command.command_type, handler.priority))
+        return PRIORITIES.get(name, PRIORITIES['comfort'])
+
+    def submit(self, command, third_party, priority=None):
+        """Queue a command. Returns a Future of the handler's result.
+
+        Parameters
+        ----------
+        command : object
+            Object of type Command
+        third_party : dict
+            Dictionary defined as {application: client} of the node running the command
+        priority : str
+            Priority class for this command only
+
+        """
+
+        future = Future()
+        handler = HANDLERS.get(command.command_type)
+        if handler is None:
+            future.set_exception(ValueError('No handler for command type {}'.format(command.command_type)))
+            return future
+
+        rank = PRIORITIES[priority] if priority is not None else self.priority(command, handler)
+        key = handler.lane(command)
+        target = (command.command_type, command.command_sensor)
+
+        if not self.threads:
+            self.start()
+
+        with self.lock:
+            job = self.waiting.get(target) if handler.state else None
+            if job is not None and self.collapse:  # Burst, one combined state is sent
+                job[1], job[2] = handler.merge(job[1], command), third_party
+                if rank < job[6]:  # The merged command makes its lane more urgent, it keeps its place
+                    job[6] = rank
+                    self.ready.promote(key, rank)
+                self.counters['collapsed'] += 1
+                return job[3]
+
+            last = self.applied.get(target) if handler.state else None
+            if job is None and last is not None and last[0] == handler.normalize(command.command_value) and \
+                    time.monotonic() - last[1] < self.window:  # Already applied, nothing to send
+                self.counters['suppressed'] += 1
+                future.set_result(None)
+                return future
+
+            job = [handler, command, third_party, future, time.perf_counter(), target, rank]
+            if handler.state:
+                self.waiting[target] = job
+            lane = self.lanes.get(key)
+            if lane is None:
+                lane = self.lanes[key] = Queue('FIFO')
+            lane.add(job)
+            if key not in self.active:
+                self.active.add(key)
+                self.ready.add(key, priority=rank)
+            else:  # Waiting lanes move up, a running lane goes back in line at this priority
+                self.ready.promote(key, rank)
+        return future
+
+    def run(self):
+        """Worker thread. Runs the next command of the most urgent ready lane."""
+
+        while True:
+            key = self.ready.get(block=True)
+            with self.lock:
+                job = self.lanes[key].get()
+                handler, command, third_party, future, queued, target, rank = job
+                if self.waiting.get(target) is job:  # Later commands for the target queue a new job
+                    del self.waiting[target]
+                value = handler.normalize(command.command_value)
+                if handler.state:
+                    self.applied[target] = (value, time.monotonic())
+                self.counters['sent'] += 1
+
+            started = time.perf_counter()
+            error = None
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(handler.function(third_party, command))
+                except Exception as exception:
+                    error = exception
+                    future.set_exception(exception)
+                    print('Command {} failed: {}'.format(command.command_name, exception))
+            finished = time.perf_counter()
+
+            with self.lock:
+                metric = self.metrics.setdefault(handler.command_type,
+                                                 {'count': 0, 'errors': 0, 'run': 0.0, 'run_max': 0.0, 'wait': 0.0})
+                metric['count'] += 1
+                metric['errors'] += error is not None
+                metric['run'] += finished - started
+                metric['run_max'] = max(metric['run_max'], finished - started)
+                metric['wait'] += started - queued
+                if error is not None and self.applied.get(target, (None,))[0] == value:
+                    del self.applied[target]  # Not applied, let the next identical command through
+
+                lane = self.lanes[key]
+                if lane:  # Lane goes back in line with the priority of its most urgent command
+                    self.ready.add(key, priority=min(job[6] for job in lane.queue))
+                else:
+                    self.active.discard(key)
+
+    def latency(self):
+        """Returns {command_type: {count, errors, avg_wait_ms, avg_run_ms, max_run_ms}}."""
+
+        with self.lock:
+            return {command_type: {'count': metric['count'], 'errors': metric['errors'],
+                                   'avg_wait_ms': metric['wait'] / metric['count'] * 1000,
+                                   'avg_run_ms': metric['run'] / metric['count'] * 1000,
+                                   'max_run_ms': metric['run_max'] * 1000}
+                    for command_type, metric in self.metrics.items()}
+
+    def __len__(self):  # Number of queued commands
+        with self.lock:
+            return sum(len(lane) for lane in self.lanes.values())
+
+    def __repr__(self):
+        return '{} queued commands in {} lanes'.format(len(self), len(self.lanes))
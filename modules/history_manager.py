@@ -0,0 +1,307 @@
+import time
+from collections import deque
+from threading import Thread, Event, Lock
+
+import sqlalchemy
+import sqlalchemy.exc
+from sqlalchemy.dialects import mysql, sqlite
+
+from config.configurations import database_pool
+from modules.database_manager import get_engine
+
+ROLLUPS = {'sensor_history_1m': 60, 'sensor_history_1h': 3600}  # {table: bucket size in seconds}
+
+
+class History(Thread):
+    """Persistent sensor history with batched writes and incremental rollups.
+
+    Readings are buffered in memory and flushed in one transaction per batch. Each flush also folds the batch into
+    the 1 minute and 1 hour rollup tables (sum, count, min, max), so averages over long windows never scan raw rows.
+
+    Attributes
+    ----------
+    engine : object
+        SQLAlchemy engine. SQLite by default, the MySQL engine works the same way. Engines are shared per url
+
+    buffer : deque
+        Readings waiting to be flushed, defined as dictionaries. When full, the oldest reading is dropped
+
+    failed : list
+        Batch whose write failed, defined as [rows, failed attempts]. Retried alone before the buffer is flushed
+
+    dropped : int
+        Number of readings dropped, from a full buffer or a batch that failed max_attempts times
+
+    retention : dict
+        Dictionary defined as {table: days to keep}. None keeps everything
+
+    Parameters
+    ----------
+    url : str
+        SQLAlchemy database url, i.e. sqlite:///smarthome.db
+
+    batch_size : int
+        Number of buffered readings that triggers an early flush
+
+    interval : int
+        Seconds between flushes
+
+    retention : dict
+        Dictionary defined as {table: days to keep}
+
+    engine : object
+        Existing SQLAlchemy engine to use instead of url
+
+    max_buffer : int
+        Readings kept while the database is unreachable
+
+    max_attempts : int
+        Failed writes after which a batch is logged and dropped
+
+    """
+
+    def __init__(self, url='sqlite:///smarthome.db', batch_size=500, interval=5, retention=None, engine=None,
+                 max_buffer=50000, max_attempts=5):
+        super().__init__(daemon=True)
+        self.engine = get_engine(url, **database_pool) if engine is None else engine  # Shares the MySQL pool
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retention = {'sensor_history': 7, 'sensor_history_1m': 30, 'sensor_history_1h': None}
+        if retention is not None:
+            self.retention.update(retention)
+        self.buffer = deque(maxlen=max_buffer)
+        self.max_attempts = max_attempts
+        self.failed = None
+        self.dropped = 0
+        self.lock = Lock()  # Serializes flushes
+        self.wake = Event()
+        self.stopped = Event()
+        self.last_retention = 0
+        self.metadata = sqlalchemy.MetaData()
+        self.tables = self.create_tables()
+
+    def create_tables(self):
+        """Create the raw and rollup tables if they do not exist."""
+
+        tables = {'sensor_history': sqlalchemy.Table(
+            'sensor_history', self.metadata,
+            sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True, autoincrement=True),
+            sqlalchemy.Column('timestamp', sqlalchemy.Float, nullable=False, index=True),
+            sqlalchemy.Column('thing_id', sqlalchemy.String(64), nullable=False),
+            sqlalchemy.Column('sensor_name', sqlalchemy.String(64), nullable=False),
+            sqlalchemy.Column('sensor_type', sqlalchemy.String(64), nullable=False),
+            sqlalchemy.Column('sensor_value', sqlalchemy.Float))}
+
+        for name in ROLLUPS:
+            tables[name] = sqlalchemy.Table(
+                name, self.metadata,
+                sqlalchemy.Column('bucket', sqlalchemy.Integer, primary_key=True),
+                sqlalchemy.Column('thing_id', sqlalchemy.String(64), primary_key=True),
+                sqlalchemy.Column('sensor_name', sqlalchemy.String(64), primary_key=True),
+                sqlalchemy.Column('sensor_type', sqlalchemy.String(64), primary_key=True),
+                sqlalchemy.Column('value_sum', sqlalchemy.Float, nullable=False),
+                sqlalchemy.Column('value_count', sqlalchemy.Integer, nullable=False),
+                sqlalchemy.Column('value_min', sqlalchemy.Float, nullable=False),
+                sqlalchemy.Column('value_max', sqlalchemy.Float, nullable=False))
+
+        self.metadata.create_all(self.engine)
+        return tables
+
+    def record(self, thing_id, readings, timestamp=None):
+        """Buffer readings. Non-numeric values are skipped.
+
+        Parameters
+        ----------
+        thing_id : str
+            Primary key of the thing that sent the readings
+
+        readings : list
+            List of dictionaries defined as {sensor_name, sensor_type, sensor_pin, sensor_value}
+
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        for reading in readings:
+            try:
+                value = float(reading['sensor_value'])
+            except (TypeError, ValueError):
+                continue
+
+            if value == value:  # Skip NaN
+                if len(self.buffer) == self.buffer.maxlen:  # Full, append drops the oldest reading
+                    self.dropped += 1
+                self.buffer.append({'timestamp': timestamp, 'thing_id': str(thing_id),
+                                    'sensor_name': reading['sensor_name'], 'sensor_type': reading['sensor_type'],
+                                    'sensor_value': value})
+
+        if len(self.buffer) >= self.batch_size:
+            self.wake.set()
+
+    def flush(self):
+        """Write buffered readings and update the rollups in one transaction. Returns the number of rows written."""
+
+        with self.lock:
+            written = 0
+            if self.failed is not None:  # Retry the failed batch first, on its own
+                rows, attempts = self.failed
+                self.failed = None
+                written += self.write(rows, attempts)
+
+            rows = []
+            while self.buffer:  # popleft is atomic, record() may keep appending
+                rows.append(self.buffer.popleft())
+
+            if rows:
+                written += self.write(rows)
+
+        return written
+
+    def write(self, rows, attempts=0):
+        """Write a batch and update the rollups in one transaction. Returns the number of rows written.
+
+        A failed batch is kept in failed for the next flush, or logged and dropped after max_attempts failures.
+        """
+
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(self.tables['sensor_history'].insert(), rows)
+                for name in ROLLUPS:
+                    connection.execute(self.upsert(name), self.rollup(rows, ROLLUPS[name]))
+        except sqlalchemy.exc.SQLAlchemyError as error:  # Transaction rolled back
+            attempts += 1
+            if attempts < self.max_attempts:
+                self.failed = [rows, attempts]
+            else:
+                self.dropped += len(rows)
+                print('History dropped {} readings from {} to {} after {} failed writes: {}'.format(
+                    len(rows), rows[0]['timestamp'], rows[-1]['timestamp'], attempts, error))
+            raise
+
+        return len(rows)
+
+    @staticmethod
+    def rollup(rows, seconds):
+        """Aggregate rows into buckets of the given size. Returns a list of rollup rows."""
+
+        buckets = dict()
+        for row in rows:
+            key = (int(row['timestamp'] // seconds * seconds), row['thing_id'], row['sensor_name'], row['sensor_type'])
+            value = row['sensor_value']
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = [value, 1, value, value]
+            else:
+                bucket[0] += value
+                bucket[1] += 1
+                bucket[2] = min(bucket[2], value)
+                bucket[3] = max(bucket[3], value)
+
+        return [{'bucket': key[0], 'thing_id': key[1], 'sensor_name': key[2], 'sensor_type': key[3],
+                 'value_sum': bucket[0], 'value_count': bucket[1], 'value_min': bucket[2], 'value_max': bucket[3]}
+                for key, bucket in buckets.items()]
+
+    def upsert(self, name):
+        """Build the statement that merges a batch into an existing rollup bucket."""
+
+        table = self.tables[name]
+        if self.engine.dialect.name == 'mysql':
+            statement = mysql.insert(table)
+            new = statement.inserted
+            least, greatest = sqlalchemy.func.least, sqlalchemy.func.greatest
+            return statement.on_duplicate_key_update(
+                value_sum=table.c.value_sum + new.value_sum,
+                value_count=table.c.value_count + new.value_count,
+                value_min=least(table.c.value_min, new.value_min),
+                value_max=greatest(table.c.value_max, new.value_max))
+
+        statement = sqlite.insert(table)
+        new = statement.excluded
+        return statement.on_conflict_do_update(
+            index_elements=['bucket', 'thing_id', 'sensor_name', 'sensor_type'],
+            set_={'value_sum': table.c.value_sum + new.value_sum,
+                  'value_count': table.c.value_count + new.value_count,
+                  'value_min': sqlalchemy.func.min(table.c.value_min, new.value_min),
+                  'value_max': sqlalchemy.func.max(table.c.value_max, new.value_max)})
+
+    def apply_retention(self, now=None):
+        """Delete rows older than each table's retention. Returns {table: deleted rows}."""
+
+        if now is None:
+            now = time.time()
+
+        deleted = dict()
+        with self.engine.begin() as connection:
+            for name, days in self.retention.items():
+                if days is None:
+                    continue
+                table = self.tables[name]
+                column = table.c.timestamp if name == 'sensor_history' else table.c.bucket
+                deleted[name] = connection.execute(table.delete().where(column < now - days * 86400)).rowcount
+        return deleted
+
+    def aggregate(self, condition_check, condition_type='average', window=3600, thing_id=None):
+        """Aggregate a sensor over the last window seconds from the rollups.
+
+        Parameters
+        ----------
+        condition_check : str
+            Type of sensors or specific sensor. i.e. LDR, LDR1, motion, motion2
+
+        condition_type : str
+            One of sum, average, min, max, count
+
+        window : int
+            Seconds to look back. Windows up to 2 hours use the 1 minute rollup, longer ones the 1 hour rollup
+
+        thing_id : str
+            Optionally limit to a single thing
+
+        """
+        name = 'sensor_history_1m' if window <= 7200 else 'sensor_history_1h'
+        table = self.tables[name]
+        column = table.c.sensor_name if any(char.isdigit() for char in condition_check) else table.c.sensor_type
+
+        total, count = sqlalchemy.func.sum(table.c.value_sum), sqlalchemy.func.sum(table.c.value_count)
+        select = {
+            'sum': total,
+            'count': count,
+            'average': total / count,
+            'min': sqlalchemy.func.min(table.c.value_min),
+            'max': sqlalchemy.func.max(table.c.value_max),
+        }[condition_type]
+
+        query = sqlalchemy.select(select).where(column == condition_check,
+                                                table.c.bucket >= time.time() - window - ROLLUPS[name])
+        if thing_id is not None:
+            query = query.where(table.c.thing_id == str(thing_id))
+
+        with self.engine.connect() as connection:
+            return connection.execute(query).scalar()
+
+    def maintain(self):
+        """Flush the buffer, and apply retention once an hour. Returns the number of rows written."""
+
+        written = self.flush()
+        if time.time() - self.last_retention >= 3600:
+            self.apply_retention()
+            self.last_retention = time.time()
+        return written
+
+    def run(self):
+        """Flush on every interval, or earlier when the buffer is full. Retention runs once an hour."""
+
+        while not self.stopped.is_set():
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try:
+                self.maintain()
+            except sqlalchemy.exc.SQLAlchemyError as error:  # Keep recording, the batch is retried next time
+                print('History flush failed: {}'.format(error))
+
+    def stop(self):
+        """Stop the flush thread and write what is left in the buffer."""
+
+        self.stopped.set()
+        self.wake.set()
+        return self.flush()
@@ -1,33 +1,48 @@
+import asyncio
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime
-import json
-from threading import Timer, Thread
+from concurrent.futures import as_completed, CancelledError, TimeoutError
+from threading import Thread, Lock
 
 from modules.database_manager import Database
-from modules.hue_manager import Hue
+from modules.hue_manager import get_hue
 from modules.ifttt_manager import WebHooks_IFTTT
-from modules.sonos_manager import Sonos
+from modules.sonos_manager import get_sonos
 from modules.mosquitto_manager import MQTT_Client
-from modules.commands_manager import Command, Rule
-import pandas as pd
+from modules.payload_manager import decode
+from modules.request_manager import Request_Manager, Device_Health
+from modules.status_manager import Status_Store
+from modules.history_manager import History
+from modules.topology_manager import Topology
+from modules.scheduler_manager import Scheduler
+from modules.executor_manager import Command_Executor
+from modules.debounce_manager import Debouncer
+from modules.presence_manager import Presence
+from modules.commands_manager import Command, Rule, Rule_Engine
+from config.configurations import history, topology, control, scheduler, executor, debounce, fan_out
 
 
 class Main(Thread):
-    def __init__(self, unique_id):
+    def __init__(self, unique_id, parent=None):
         super().__init__()
+        self.parent = parent
         self.mosquitto = MQTT_Client(self.mosquitto_callback)
         self.database = Database()
-        self.requests = dict()
+        self.topology = Topology(self.database, unique_id, **topology).load() if parent is None else parent.topology
+        self.requests = Request_Manager()
+        self.health = Device_Health(fan_out['backoff'], fan_out['max_backoff']) if parent is None else parent.health
+        self.presence = None if parent is None else parent.presence  # Set by Home before its rooms are built
         self.third_party = dict()
-        self.timers = dict()
-        self.status = pd.DataFrame()
+        self.timers = Scheduler(**scheduler) if parent is None else parent.timers  # One timer thread per home
+        self.executor = Command_Executor(**executor) if parent is None else parent.executor  # Shared device lanes
+        self.status = Status_Store(None if parent is None else parent.status)  # Updates flow up to room and home
         self.children = None
         self.mqtt_data = None
         self.name = None
         self.rules = None
         self.conditions = None
         self.commands = None
+        self.engine = Rule_Engine()
+        self.loop = None  # Event loop when run by Async_Runtime
         self.data = None
         self.get_data(unique_id)
 
@@ -42,70 +57,153 @@ class Main(Thread):
         """Initialize third-party applications."""
 
         # TODO make this dynamic
-        self.third_party.update({'hue': Hue(ip_addr='192.168.50.37', user='pJPb8WW2wW1P82RKu1sHBLkEQofDMofh2yNDnXzj')})
-        self.third_party.update({'sonos': Sonos('192.168.50.59')})
+        # Shared by every node, so the bridge sees one rate limited sender and one refresh
+        self.third_party.update({'hue': get_hue(ip_addr='192.168.50.37',
+                                                user='pJPb8WW2wW1P82RKu1sHBLkEQofDMofh2yNDnXzj')})
+        self.third_party.update({'sonos': get_sonos('192.168.50.59')})  # One announcement queue per speaker
         self.third_party.update({'ifttt': WebHooks_IFTTT('ckcorpj6ouQG_nn2YGYyQn')})
 
         return 'Third-party initialized'
 
-    def send_request(self, request):
+    def open_requests(self, request):
+        """Send a request to every thing in this tree that is not backed off, all at once.
+
+        Returns a tuple defined as ({Future: (thing, request_id)}, list of skipped thing IDs).
+        """
+
+        pending, skipped = dict(), []
+        for node in self.walk():
+            if isinstance(node, Thing):
+                device_id = node.data['device_id']
+                if self.presence.is_online(device_id) and self.health.available(device_id):
+                    request_id, future = node.open_request(request)
+                    pending[future] = (node, request_id)
+                else:
+                    skipped.append(device_id)
+        return pending, skipped
+
+    def stream_request(self, request, deadline=None):
+        """Send a request to every thing in this tree and yield the responses as they arrive.
+
+        Yields tuples defined as (thing_id, state, readings). state is ok, skipped (offline or backed off) or
+        timeout (no response within deadline seconds). Readings are None unless state is ok.
+        """
+
+        deadline = fan_out['deadline'] if deadline is None else deadline
+        pending, skipped = self.open_requests(request)
+        try:
+            for thing_id in skipped:
+                yield thing_id, 'skipped', None
+
+            try:
+                for future in as_completed(list(pending), timeout=deadline):
+                    thing, request_id = pending.pop(future)
+                    if not future.cancelled():
+                        self.health.success(thing.data['device_id'])
+                        yield thing.data['device_id'], 'ok', future.result()
+            except TimeoutError:  # Deadline passed, the rest are reported as timed out
+                pass
+
+            for future in list(pending):
+                thing, request_id = pending.pop(future)
+                thing.requests.cancel(request_id)
+                self.health.failure(thing.data['device_id'])
+                yield thing.data['device_id'], 'timeout', None
+        finally:  # Caller stopped early
+            for thing, request_id in pending.values():
+                thing.requests.cancel(request_id)
+
+    def fan_out(self, request, deadline=None):
+        """Send a request to every thing in this tree and wait at most deadline seconds.
+
+        Returns a dictionary defined as {results: {thing_id: readings}, timed_out: [thing_id], skipped: [thing_id]}.
+        """
+
+        report = {'results': dict(), 'timed_out': [], 'skipped': []}
+        for thing_id, state, readings in self.stream_request(request, deadline):
+            if state == 'ok':
+                report['results'][thing_id] = readings
+            else:
+                report['timed_out' if state == 'timeout' else 'skipped'].append(thing_id)
+        return report
+
+    def send_request(self, request, deadline=None):
+        """Send a request to every thing in this tree. Returns the readings that arrived before the deadline."""
+
         results = []
-        status = []  # Initialize empty condition list
-        with ThreadPoolExecutor() as executor:  # Begin sub-threads
-            for child in self.children:
-                status.append(executor.submit(
-                    self.children[child].send_request, request=request))  # submit to pool
+        for thing_id, state, readings in self.stream_request(request, deadline):
+            if state == 'ok':
+                results += readings
+        return results
+
+    async def async_send_request(self, request, deadline=None):
+        """asyncio version of send_request. Every thing in the tree is awaited concurrently."""
 
-            for result in as_completed(status):  # Wait until all things have been read
-                results += result.result()
+        deadline = fan_out['deadline'] if deadline is None else deadline
+        pending, skipped = self.open_requests(request)
+        waiting = {asyncio.wrap_future(future): pending[future] for future in pending}
+        done, late = await asyncio.wait(waiting, timeout=deadline) if waiting else (set(), set())
 
-        if request == 'status':
-            self.status = pd.DataFrame(results)
+        results = []
+        for future in done:
+            thing, request_id = waiting[future]
+            if not future.cancelled():
+                self.health.success(thing.data['device_id'])
+                results += future.result()
+        for future in late:
+            thing, request_id = waiting[future]
+            thing.requests.cancel(request_id)
+            self.health.failure(thing.data['device_id'])
         return results
 
+    def walk(self):
+        """Yields this node and every node below it."""
+        yield self
+        if self.children is not None:
+            for child in self.children:
+                yield from self.children[child].walk()
+
+    def cancel_requests(self):
+        """Cancel every pending request on this node and its children. Returns the number cancelled."""
+        cancelled = self.requests.cancel_all()
+        if self.children is not None:
+            for child in self.children:
+                cancelled += self.children[child].cancel_requests()
+        return cancelled
+
     def mosquitto_callback(self, client, userdata, message):
         """Mosquitto callback function."""
-        msg = message.payload.decode("utf-8")  # Decode message
+        msg = decode(message.payload)  # Decode JSON or binary payload to dictionary
         topic = message.topic  # Get topic
         print('\n{} Received message!\n{}\n{}\n'.format(self.data['name'], topic, msg))
-        msg = msg.replace("'", "\"")  # Replace single for double quotes
-        msg = json.loads(msg)  # convert string to dictionary
+
+        if 'thing_id' in msg:  # Any message from a thing shows it is alive
+            self.presence.seen(msg['thing_id'])
 
         if 'interrupt' in topic:  # If interrupt
             if isinstance(self, Room):  # Only execute interrupts at the room level
-                self.execute(msg['interrupt'], 'interrupt')
+                self.record(msg['thing_id'], [msg['interrupt']], msg.get('timestamp'))
+                self.debouncer.submit(msg['interrupt'], self.timers)  # Bursts reach the rules once
 
         elif 'request' in topic:  # If request
             self.execute(msg['request'], 'request')
 
         elif 'response' in topic:  # If response
-            self.requests[msg['request_id']] = msg['response']
+            if isinstance(msg['response'], list):  # Status readings
+                self.record(msg.get('thing_id', self.data['device_id']), msg['response'])
+            self.requests.resolve(msg['request_id'], msg['response'])
+
+    def record(self, thing_id, readings, timestamp=None):
+        """Store readings once, in the child thing's store when known. Stores forward updates up the tree."""
+        if self.children is not None and thing_id in self.children:
+            self.children[thing_id].status.update(thing_id, readings, timestamp)
+        else:
+            self.status.update(thing_id, readings, timestamp)
 
     def execute(self, command, command_type):
         """Execute command."""
         if command_type == 'interrupt':
-            data = self.rules.query('rule_sensor == "{}"'.format(command['sensor_type'])).to_dict(
-                orient='records')  # get rules data
-            command = []
-            for rule in data:
-                if rule['rule_function'] != 'None':
-                    cmd = (  # Build command tuple
-                        Command(self.commands.query('command_name == "{}"'.format(rule['rule_command'])).
-                                to_dict(orient='records')[0]),
-
-                        Command(self.commands.query('command_name == "{}"'.format(rule['rule_function'])).
-                                to_dict(orient='records')[0])
-                    )
-                else:
-                    cmd = (  # Build command tuple
-                        Command(self.commands.query('command_name == "{}"'.format(rule['rule_command'])).
-                                to_dict(orient='records')[0]), None)
-                conditions = True
-                if not self.conditions.empty:
-                    conditions = self.conditions.query(  # Get all condition data
-                        'rule_id == {}'.format(rule['rule_id'])).to_dict(orient='records')
-
-                command.append(Rule(rule, cmd, conditions))  # initialize new Rule object
+            command = list(self.engine.match(command['sensor_type']))  # Compiled rules for this sensor
 
         elif command_type == 'command':
             if not isinstance(command, Command):
@@ -113,72 +211,76 @@ class Main(Thread):
 
         print(command)  # Print the canonical string representation
         if isinstance(command, Command):  # If object is of type Command
-            # ***************** Phillips Hue - Third Party Commands *****************
-            if command.command_type == 'hue':
-                if 'hue' in self.third_party:
-                    command.command_value = command.command_value.replace("'", "\"")
+            return self.executor.submit(command, self.third_party)  # Runs on the device's lane, never blocks
 
-                    print(self.third_party['hue'].set_group(command.command_sensor, command.command_value))
+        elif len(command) > 0 and isinstance(command[0], Rule):
+            status = self.get_status(current=False)  # True for current status, False for last known status.
+            for rule in self.engine.evaluate(command, status):  # Rules that pass all conditions
+                self.process_rule(rule)
+
+    def process_rule(self, rule):
+        """Run a rule whose conditions are met."""
+        print(rule)
+        if rule.rule_timer > 0 and rule.commands[1] is not None:  # Create new timer, replaces the pending one
+            self.timers.schedule(
+                key=(self.data['device_id'], rule.rule_id), delay=rule.rule_timer, function=self.execute,
+                args=[rule.commands[1], 'command'],
+                payload={'device_id': self.data['device_id'], 'command_name': rule.commands[1].command_name})
+        return self.execute(rule.commands[0], command_type='command')
+
+    def find(self, device_id):
+        """Returns the node with the given device_id in this tree, or None."""
+        if self.data['device_id'] == device_id:
+            return self
+        if self.children is not None:
+            for child in self.children:
+                node = self.children[child].find(device_id)
+                if node is not None:
+                    return node
+        return None
+
+    def restore_timer(self, payload):
+        """Resolve a timer saved by a previous run to (function, args)."""
+        node = self.find(payload['device_id'])
+        if node is not None and node.engine.command(payload['command_name']) is not None:
+            return node.execute, [node.engine.command(payload['command_name']), 'command']
+        return None
 
-            # ***************** Sonos - Third Party Commands *****************
-            elif command.command_type == 'sonos':
-                if command.command_sensor == 'listen' and command.command_value == 'random':
-                    self.third_party['sonos'].listen()
+    def get_data(self, unique_id):
+        self.rules = self.topology.rules(unique_id)
+        self.conditions = self.topology.conditions(unique_id)
+        self.commands = self.topology.commands(unique_id)
 
-                elif command.command_sensor == 'listen':
-                    self.third_party['sonos'].listen(command.command_value)
+        self.engine.compile(self.rules, self.conditions, self.commands)
 
-                elif command.command_sensor == 'speak':
-                    self.third_party['sonos'].player.volume += 10
-                    self.third_party['sonos'].speak(command.command_value)
-                    self.third_party['sonos'].player.volume -= 10
+    def reload_rules(self):
+        """Recompile rules, conditions and commands from the topology on this node and its children.
 
-        elif len(command) > 0 and isinstance(command[0], Rule):
-            status = self.get_status(current=False)  # True for current status, False for last known status.
-            check_rules = []  # Initialize empty condition list
-            results = []  # Initialize empty result list
-            with ThreadPoolExecutor() as executor:  # Begin sub-threads
-                for cmd in command:  # iterate through each command
-                    check_rules.append(
-                        executor.submit(self.process_rule, rule=cmd, status=status))  # submit to thread pool
-
-                for result in as_completed(check_rules):  # Wait until all conditions have finished
-                    results.append(result.result())  # Append result to result list
-
-    def process_rule(self, rule, status):
-        if rule.check_conditions(status):  # If Rule passes all conditions
-            print(rule)
-            if rule.rule_sensor in self.timers:  # If timer exists, cancel and replace
-                self.timers[rule.rule_sensor].cancel()
-
-            if rule.rule_timer > 0:  # Create new timer
-                self.timers.update(
-                    {rule.rule_sensor: Timer(
-                        interval=rule.rule_timer, function=self.execute, args=[rule.commands[1], 'command']
-                    )})
-                self.timers[rule.rule_sensor].start()
-            return self.execute(rule.commands[0], command_type='command')
+        Unchanged rules keep their compiled objects and running timers are left alone.
+        Returns a dictionary defined as {added, changed, removed, unchanged: number of rules}.
+        """
+        self.rules = self.topology.rules(self.data['device_id'])
+        self.conditions = self.topology.conditions(self.data['device_id'])
+        self.commands = self.topology.commands(self.data['device_id'])
+        changes = self.engine.compile(self.rules, self.conditions, self.commands)
 
-    def get_data(self, unique_id):
-        self.rules = self.database.query(
-            'select * '
-            'from rules '
-            'where device_id="{}"'.format(unique_id))
-
-        self.conditions = self.database.query(
-            'select * '
-            'from conditions '
-            'where rule_id in '
-            '(select rule_id from rules where device_id="{}")'.format(unique_id))
-
-        self.commands = self.database.query(
-            'select * '
-            'from commands '
-            'where device_id="{}"'.format(unique_id))
+        if self.children is not None:
+            for child in self.children:
+                for change, count in self.children[child].reload_rules().items():
+                    changes[change] += count
+        return changes
+
+    async def async_get_status(self, current=True):
+        """asyncio version of get_status."""
+        if current:
+            await self.async_send_request('status')
+
+        return self.status
 
     def get_status(self, current=True):
+        """Returns the Status_Store. current=True refreshes it with a status request first."""
         if current:
-            self.status = pd.DataFrame(self.send_request('status'))
+            self.send_request('status')  # Responses update the store as they arrive
 
         return self.status
 
@@ -192,135 +294,156 @@ class Main(Thread):
 
 class Home(Main):
     def __init__(self, unique_id):
+        started = time.perf_counter()
         super().__init__(unique_id)
-        self.children = {child: Room(child)
+        self.presence = Presence(self.data['device_id'])  # Registers the hub's last will before connecting
+        self.history = History(**history)
+        self.status.history = self.history  # Every reading in the home reaches this store
+        self.control = MQTT_Client(self.control_callback)
+        self.reload_lock = Lock()
+        self.children = {child: Room(child, self)
                          for child in self.data['rooms']}
+        print('Home {} built in {:.1f} ms'.format(self.data['name'], (time.perf_counter() - started) * 1000))
+
+    def initialize(self):
+        super(Home, self).initialize()
+        self.history.start()  # Begin flushing sensor history
+        self.timers.start()  # Begin running timers
+        print('Restored {} timers'.format(self.timers.restore(self.restore_timer)))
+        print(self.control.listen([control['reload']]))  # Reload on request
+        self.presence.start()  # Track things, announce the hub
+        if control['poll']:
+            Thread(target=self.watch, daemon=True).start()  # Reload when the tables change
+
+    def control_callback(self, client, userdata, message):
+        """Mosquitto callback for the control channel."""
+        print('Reload requested on {}'.format(message.topic))
+        if self.loop is not None:  # asyncio runtime, reload queries the database
+            return self.loop.run_in_executor(None, self.reload)
+        self.reload()
+
+    def reload(self):
+        """Reload rules, conditions and commands for the whole home without restarting."""
+        started = time.perf_counter()
+        with self.reload_lock:  # One reload at a time
+            for table in ('rules', 'conditions', 'commands'):
+                self.database.invalidate(table)
+            self.topology.load(prefer_snapshot=False)
+            changes = self.reload_rules()
+
+        print('Rules reloaded in {:.1f} ms | {}'.format((time.perf_counter() - started) * 1000, changes))
+        return changes
+
+    def watch(self):
+        """Poll the version query and reload when it changes."""
+        version = None
+        while True:
+            try:
+                current = self.database.query(control['version_query']).to_dict(orient='records')[0]
+            except Exception as error:  # i.e. tables without an updated_at column
+                print('Stopped watching for rule changes: {}'.format(error))
+                return
+
+            if version is not None and current != version:
+                try:
+                    self.reload()
+                except Exception as error:  # Keep the rules in use and try again on the next poll
+                    print('Could not reload rules: {}'.format(error))
+                    time.sleep(control['poll'])
+                    continue
+            version = current
+            time.sleep(control['poll'])
 
     def get_data(self, unique_id):
         super(Home, self).get_data(unique_id)
-        info = self.database.query(
-            'select * '
-            'from homes '
-            'where home_id="{}"'.format(unique_id)).to_dict(orient='records')[0]
+        info = self.topology.home(unique_id)
 
         self.data = {
             'device_id': info['home_id'],
             'name': info['home_name'],
             'description': info['home_description'],
-            'rooms': self.database.query(
-                'select room_id '
-                'from rooms '
-                'where home_id="{}"'.format(unique_id))['room_id'].tolist(),
+            'rooms': self.topology.rooms(unique_id),
         }
 
         self.mqtt_data = {
-            'subscribe': self.database.query(
-                'select channel_broadcast '
-                'from mosquitto_channels '
-                'where info_level=1 and channel_type="requests"')['channel_broadcast'].tolist(),
-
-            'publish': self.database.query(
-                'select channel_broadcast '
-                'from mosquitto_channels '
-                'where info_level=1 and channel_type="response"')['channel_broadcast']
+            'subscribe': self.topology.channels(1, 'requests'),
+            'publish': self.topology.channels(1, 'response')
         }
 
 
 class Room(Main):
-    def __init__(self, data):
-        super(Room, self).__init__(data)
-        self.children = {child: Thing(child)  # Create dictionary of Things
+    def __init__(self, data, parent=None):
+        super(Room, self).__init__(data, parent)
+        self.children = {child: Thing(child, self)  # Create dictionary of Things
                          for child in self.data['things']}
+        self.debouncer = Debouncer(lambda interrupt: self.execute(interrupt, 'interrupt'), self.data['device_id'],
+                                   **debounce)
 
     def get_data(self, unique_id):
         super(Room, self).get_data(unique_id)
-        info = self.database.query(
-            'select * '
-            'from rooms '
-            'where room_id="{}"'.format(unique_id)).to_dict(orient='records')[0]
+        info = self.topology.room(unique_id)
 
         self.data = {
             'device_id': info['room_id'],
             'name': info['room_name'],
             'description': info['room_description'],
-            'things': self.database.query(
-                'select thing_id '
-                'from things '
-                'where room_id="{}"'.format(unique_id))['thing_id'].tolist(),
+            'things': self.topology.things(unique_id),
         }
 
         self.mqtt_data = {
-            'subscribe': self.database.query(
-                'select channel_broadcast '
-                'from mosquitto_channels '
-                'where info_level=2 and channel_type in ("requests","interrupt")')
-                .replace('room_name', self.data['name'].replace(' ', '_').lower(), regex=True)['channel_broadcast']
-                .tolist(),
-
-            'publish': self.database.query(
-                'select channel_broadcast '
-                'from mosquitto_channels '
-                'where info_level=2 and channel_type="response"')
-                .replace('room_name', self.data['name'].replace(' ', '_').lower(), regex=True)['channel_broadcast']
-                .tolist()[0]
+            'subscribe': self.topology.channels(2, ['requests', 'interrupt'], room_name=self.data['name']),
+            'publish': self.topology.channels(2, 'response', room_name=self.data['name'])[0]
         }
 
 
 class Thing(Main):
-    def __init__(self, data):
-        super().__init__(data)
+    def __init__(self, data, parent=None):
+        super().__init__(data, parent)
 
-    def send_request(self, request, timeout=20):
-        request_id = datetime.now().strftime("%m%d%Y%H%M%S")
-        self.requests.update({request_id: None})
+    def open_request(self, request):
+        """Publish a request. Returns a tuple defined as (request_id, Future), completed by the mosquitto callback."""
+
+        request_id, response = self.requests.open()  # Unique ID and future completed by the mosquitto callback
 
         payload = {"request_id": request_id, "request": request}  # define payload
 
         self.mosquitto.broadcast(self.mqtt_data['publish'], payload)  # Request
+        return request_id, response
+
+    def send_request(self, request, deadline=20):
+        if not self.presence.is_online(self.data['device_id']):  # Announced offline or silent, do not wait
+            print('{} is offline'.format(self.data['name']))
+            return []
+
+        request_id, response = self.open_request(request)
 
-        started = datetime.now()
         try:
-            while self.requests[request_id] is None:
-                if (datetime.now() - started).total_seconds() >= timeout:
-                    print('No Response. Device might be disconnected')
-                    return []
-            return self.requests.pop(request_id)
-        except:
-            print('Error occurred with {}'.format(self.__class__.__name__))
+            results = self.requests.wait(request_id, response, deadline)  # Sleep until response or timeout
+            self.health.success(self.data['device_id'])
+            return results
+        except TimeoutError:
+            print('No Response. Device might be disconnected')
+            self.health.failure(self.data['device_id'])
+            return []
+        except CancelledError:
+            print('Request {} cancelled'.format(request_id))
+            return []
 
     def get_data(self, unique_id):
         super(Thing, self).get_data(unique_id)
-        info = self.database.query(
-            'select * '
-            'from things '
-            'where thing_id="{}"'.format(unique_id)).to_dict(orient='records')[0]
+        info = self.topology.thing(unique_id)
 
         self.data = {
             'device_id': info['thing_id'],
             'room_id': info['room_id'],
-            'room_name': self.database.query(
-                'select room_name '
-                'from rooms '
-                'where room_id ="{}"'.format(info['room_id']))['room_name'].tolist()[0],
+            'room_name': self.topology.room(info['room_id'])['room_name'],
             'name': info['thing_name'],
             'description': info['thing_description']
         }
 
         self.mqtt_data = {
-            'subscribe': self.database.query(
-                'select channel_broadcast '
-                'from mosquitto_channels '
-                'where info_level=3 and channel_type in ("response", "interrupt")')
-                .replace('room_name', self.data['room_name'].replace(' ', '_').lower(), regex=True)
-                .replace('thing_name', self.data['name'].replace(' ', '_').lower(), regex=True)[
-                'channel_broadcast'].tolist(),
-
-            'publish': self.database.query(
-                'select channel_broadcast '
-                'from mosquitto_channels '
-                'where info_level=3 and channel_type="requests"')
-                .replace('room_name', self.data['room_name'].replace(' ', '_').lower(), regex=True)
-                .replace('thing_name', self.data['name'].replace(' ', '_').lower(), regex=True)[
-                'channel_broadcast'].tolist()[0],
-
+            'subscribe': self.topology.channels(3, ['response', 'interrupt'],
+                                                room_name=self.data['room_name'], thing_name=self.data['name']),
+            'publish': self.topology.channels(3, 'requests',
+                                              room_name=self.data['room_name'], thing_name=self.data['name'])[0],
         }
@@ -1,11 +1,25 @@
 import json
+import time
+from collections import OrderedDict
+from threading import Thread, Condition, Lock
 
 import requests
+from requests.adapters import HTTPAdapter
+
+STATE = ('on', 'bri', 'hue', 'sat', 'xy', 'ct', 'effect')  # Attributes a light keeps, others (alert, scene) are actions
 
 
 class Hue:
     """Third-Party API representing Hue Light bulbs
 
+    All requests share one keep-alive session. Commands sent with queue_light and queue_group go through a rate
+    limited send queue, which keeps only the latest state per light or group and sends a group action instead when
+    every light of a group is waiting for the same state.
+
+    A mirror of the bridge's lights, groups and scenes is kept in memory. It is refreshed every refresh seconds and
+    updated from our own successful commands, so lookups never go to the bridge and commands that would not change
+    anything are not sent.
+
     Attributes
     ----------
     ip_address : str
@@ -14,21 +28,178 @@ class Hue:
         User name for phillips hue hub
     data : json
         Json object containing all the data in Phillips hue
+    groups : dict
+        Dictionary defined as {group_id: set of light IDs}
+    pending : OrderedDict
+        Send queue defined as {(resource, resource_id): state}, resource is lights or groups
+    mirror : dict
+        Dictionary defined as {resource: {resource_id: data}} for lights, groups and scenes
+    names : dict
+        Dictionary defined as {resource: {lower case name: resource_id}}
+    counters : dict
+        Dictionary defined as {queued, coalesced, merged, skipped, sent, failed}
+
+    Parameters
+    ----------
+    pool_size : int
+        Number of keep-alive connections to the bridge
+    rates : dict
+        Dictionary defined as {resource: commands per second}. The bridge handles about 10 light and 1 group
+        command per second
+    timeout : int
+        Seconds to wait for the bridge
+    refresh : int
+        Seconds between mirror refreshes, None to only refresh on demand
 
     """
 
-    def __init__(self, ip_addr, user):
+    def __init__(self, ip_addr, user, pool_size=4, rates=None, timeout=5, refresh=30):
         self.ip_addr = ip_addr  # Set phillips ip address
         self.user = user  # Set user
         self.data = None  # Initialize empty data
+        self.groups = dict()
+        self.light_groups = dict()  # {light_id: [group_id]}, smallest group first
+        self.timeout = timeout
+
+        self.session = requests.Session()  # Reuse connections to the bridge
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+        self.rates = {'lights': 10, 'groups': 1} if rates is None else rates
+        self.next_send = {resource: 0 for resource in self.rates}
+        self.pending = OrderedDict()
+        self.condition = Condition()
+        self.counters = dict.fromkeys(['queued', 'coalesced', 'merged', 'skipped', 'sent', 'failed'], 0)
+        self.sender = None
+
+        self.mirror = {'lights': dict(), 'groups': dict(), 'scenes': dict()}
+        self.names = {'lights': dict(), 'groups': dict(), 'scenes': dict()}
+        self.refreshed = None
+
         self.load()  # Load all data
+        if refresh:
+            Thread(target=self.keep_refreshed, args=(refresh,), daemon=True).start()
+
+    def url(self, *path):
+        return '/'.join(['http://{}/api/{}'.format(self.ip_addr, self.user)] + [str(part) for part in path])
 
     def load(self):
-        url = 'http://{}/api/{}'.format(self.ip_addr, self.user)
-        get_data = requests.get(url=url)
+        get_data = self.session.get(url=self.url(), timeout=self.timeout)
         self.data = get_data.json()
+
+        with self.condition:
+            for resource in self.mirror:
+                self.mirror[resource] = {str(key): value for key, value in self.data.get(resource, {}).items()}
+            self.index()
+        self.refreshed = time.time()
         return self.data
 
+    def index(self):
+        """Rebuild the name and group membership lookups from the mirror."""
+
+        self.names = {resource: {item.get('name', '').lower(): key for key, item in self.mirror[resource].items()}
+                      for resource in self.mirror}
+        self.groups = {group_id: set(group['lights'])
+                       for group_id, group in self.mirror['groups'].items() if group.get('lights')}
+        self.light_groups = dict()
+        for group_id in sorted(self.groups, key=lambda group: len(self.groups[group])):
+            for light_id in self.groups[group_id]:
+                self.light_groups.setdefault(light_id, []).append(group_id)
+
+    def refresh(self, resources=('lights', 'groups')):
+        """Read lights and groups (not the whole bridge config) and update the mirror.
+
+        Returns the differences as {resource: {resource_id: {attribute: new value}}}, a removed item maps to None.
+        """
+
+        fetched = {resource: self.session.get(url=self.url(resource), timeout=self.timeout).json()
+                   for resource in resources}
+
+        changes = dict()
+        with self.condition:
+            for resource, items in fetched.items():
+                items = {str(key): value for key, value in items.items()}
+                current = self.mirror[resource]
+                diff = {key: None for key in current if key not in items}
+
+                for key, item in items.items():
+                    if key not in current:
+                        diff[key] = item
+                        continue
+                    old = current[key]
+                    changed = {attribute: value for attribute, value in item.items()
+                               if attribute not in ('state', 'action') and old.get(attribute) != value}
+                    for nested in ('state', 'action'):  # Compare light state and group action per attribute
+                        if nested in item:
+                            changed.update({attribute: value for attribute, value in item[nested].items()
+                                            if old.get(nested, {}).get(attribute) != value})
+                    if changed:
+                        diff[key] = changed
+
+                self.mirror[resource] = items
+                if diff:
+                    changes[resource] = diff
+
+            if changes:
+                self.index()
+        self.refreshed = time.time()
+        return changes
+
+    def keep_refreshed(self, interval):
+        """Background thread. Refreshes the mirror every interval seconds."""
+
+        while True:
+            time.sleep(interval)
+            try:
+                self.refresh()
+            except (requests.RequestException, ValueError) as error:  # Keep the last known state
+                print('Hue refresh failed: {}'.format(error))
+
+    def resolve(self, resource, name_or_id):
+        """Returns the ID of a light, group or scene by name (any case) or ID. Unknown values are returned as is."""
+
+        key = str(name_or_id)
+        if key in self.mirror[resource]:
+            return key
+        return self.names[resource].get(key.lower(), key)
+
+    def find(self, resource, name_or_id):
+        """Returns the mirrored light, group or scene by name (any case) or ID, None if unknown."""
+        return self.mirror[resource].get(self.resolve(resource, name_or_id))
+
+    def light(self, name_or_id):
+        return self.find('lights', name_or_id)
+
+    def group(self, name_or_id):
+        return self.find('groups', name_or_id)
+
+    def scene(self, name_or_id):
+        return self.find('scenes', name_or_id)
+
+    def is_current(self, resource, resource_id, attribute, value):
+        """True if the mirror says the light, or every light of the group, already has the value."""
+
+        if attribute not in STATE:
+            return False
+
+        lights = [resource_id] if resource == 'lights' else self.groups.get(resource_id)
+        if not lights:
+            return False
+        return all(self.mirror['lights'].get(light_id, {}).get('state', {}).get(attribute) == value
+                   for light_id in lights)
+
+    def apply(self, resource, resource_id, state):
+        """Update the mirror with a state the bridge accepted."""
+
+        with self.condition:
+            lights = [resource_id] if resource == 'lights' else self.groups.get(resource_id, ())
+            for light_id in lights:
+                light = self.mirror['lights'].get(light_id)
+                if light is not None:
+                    light.setdefault('state', dict()).update(
+                        {attribute: value for attribute, value in state.items() if attribute in STATE})
+            if resource == 'groups' and resource_id in self.mirror['groups']:
+                self.mirror['groups'][resource_id].setdefault('action', dict()).update(state)
+
     def set_light(self, hue_id, light_command):
         """Set a single light.
 
@@ -41,8 +212,9 @@ class Hue:
 
         """
 
-        url = 'http://{}/api/{}/lights/{}/state'.format(self.ip_addr, self.user, hue_id)
-        response = requests.put(url=url, data=light_command).json()
+        url = self.url('lights', hue_id, 'state')
+        response = self.session.put(url=url, data=light_command, timeout=self.timeout).json()
+        self.apply_response('lights', hue_id, response)
         return response
 
     def set_group(self, group_id, group_command):
@@ -57,14 +229,25 @@ class Hue:
 
         """
 
-        url = 'http://{}/api/{}/groups/{}/action'.format(self.ip_addr, self.user, group_id)
-        response = requests.put(url=url, data=group_command).json()
+        url = self.url('groups', group_id, 'action')
+        response = self.session.put(url=url, data=group_command, timeout=self.timeout).json()
+        self.apply_response('groups', group_id, response)
         return response
 
+    def apply_response(self, resource, resource_id, response):
+        """Update the mirror from the success entries of a bridge response, i.e. {"/lights/1/state/on": true}."""
+
+        state = dict()
+        for item in response if isinstance(response, list) else []:
+            for address, value in item.get('success', {}).items():
+                state[address.rsplit('/', 1)[-1]] = value
+        if state:
+            self.apply(resource, str(resource_id), state)
+
     def get_group(self, group_id):
         """Returns phillip's hue group data"""
-        url = 'http://{}/api/{}/groups/{}'.format(self.ip_addr, self.user, group_id)
-        response = requests.get(url=url).json()
+        url = self.url('groups', group_id)
+        response = self.session.get(url=url, timeout=self.timeout).json()
         return response
 
     def add_group(self, group_name, hue_lights):
@@ -84,6 +267,127 @@ class Hue:
         }
 
         group_command = json.dumps(group_command)
-        url = 'http://{}/api/{}/groups/'.format(self.ip_addr, self.user)
-        response = requests.post(url=url, data=group_command).json()
+        url = self.url('groups') + '/'
+        response = self.session.post(url=url, data=group_command, timeout=self.timeout).json()
         return response
+
+    def queue_light(self, hue_id, light_command):
+        """Queue a light state. Returns right away, the send queue delivers it. Light names are accepted."""
+        self.queue('lights', hue_id, light_command)
+
+    def queue_group(self, group_id, group_command):
+        """Queue a group action. Returns right away, the send queue delivers it. Group names are accepted."""
+        self.queue('groups', group_id, group_command)
+
+    def queue(self, resource, resource_id, command):
+        """Add a command to the send queue, merged into any state still waiting for the same light or group.
+
+        Parameters
+        ----------
+        resource : str
+            lights or groups
+        resource_id : int
+            Primary key or name of the light or group
+        command : str or dict
+            State to send, i.e. '{"bri": 50, "on": false}'
+
+        """
+
+        if isinstance(command, str):
+            command = json.loads(command)
+        key = (resource, self.resolve(resource, resource_id))
+
+        with self.condition:
+            self.counters['queued'] += 1
+            waiting = key in self.pending or any(('lights', light_id) in self.pending
+                                                 for light_id in self.groups.get(key[1], ()))
+            if not waiting:  # Nothing queued could change the state, leave out what the mirror already has
+                command = {attribute: value for attribute, value in command.items()
+                           if not self.is_current(resource, key[1], attribute, value)}
+                if not any(attribute != 'transitiontime' for attribute in command):
+                    self.counters['skipped'] += 1
+                    return
+
+            if key in self.pending:  # Latest value of every attribute wins
+                self.pending[key].update(command)
+                self.pending.move_to_end(key)
+                self.counters['coalesced'] += 1
+            else:
+                self.pending[key] = dict(command)
+
+            if resource == 'groups':  # Light attributes the group action overrides are never sent
+                for light_id in self.groups.get(key[1], ()):
+                    state = self.pending.get(('lights', light_id))
+                    if state is not None:
+                        for attribute in command:
+                            state.pop(attribute, None)
+                        if not state:
+                            del self.pending[('lights', light_id)]
+                            self.counters['coalesced'] += 1
+
+            if self.sender is None:
+                self.sender = Thread(target=self.send_queue, daemon=True)
+                self.sender.start()
+            self.condition.notify()
+
+    def next_command(self):
+        """Pop the next command, as a group action when all lights of a group wait for the same state."""
+
+        key, state = self.pending.popitem(last=False)
+        if key[0] != 'lights':
+            return key, state
+
+        for group_id in self.light_groups.get(key[1], ()):
+            lights = self.groups[group_id] - {key[1]}
+            if lights and all(self.pending.get(('lights', light_id)) == state for light_id in lights):
+                for light_id in lights:
+                    del self.pending[('lights', light_id)]
+                self.counters['merged'] += len(lights) + 1
+                return ('groups', group_id), state
+
+        return key, state
+
+    def send_queue(self):
+        """Sender thread. Sends queued commands no faster than the bridge's rate limits."""
+
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+
+                wait = self.next_send[next(iter(self.pending))[0]] - time.monotonic()
+                if wait > 0:  # Let more commands coalesce while waiting for a slot
+                    self.condition.wait(wait)
+                    continue
+
+                (resource, resource_id), state = self.next_command()
+
+            wait = self.next_send[resource] - time.monotonic()  # A merged group action has its own limit
+            if wait > 0:
+                time.sleep(wait)
+            self.next_send[resource] = time.monotonic() + 1 / self.rates[resource]
+
+            path = ('lights', resource_id, 'state') if resource == 'lights' else ('groups', resource_id, 'action')
+            try:
+                response = self.session.put(url=self.url(*path), json=state, timeout=self.timeout).json()
+                errors = [item['error'] for item in response if isinstance(item, dict) and 'error' in item]
+                if errors:
+                    raise ValueError(errors)
+                self.apply(resource, resource_id, state)
+                self.counters['sent'] += 1
+            except (requests.RequestException, ValueError) as error:
+                self.counters['failed'] += 1
+                print('Hue {} {} failed: {}'.format(resource, resource_id, error))
+
+
+bridges = dict()  # {(ip_addr, user): Hue}, one session, send queue and mirror per bridge in the process
+bridges_lock = Lock()
+
+
+def get_hue(ip_addr, user, **options):
+    """Returns the shared Hue client for a bridge, creating it on first use."""
+
+    with bridges_lock:
+        if (ip_addr, user) not in bridges:
+            bridges[(ip_addr, user)] = Hue(ip_addr, user, **options)
+        return bridges[(ip_addr, user)]
@@ -1,34 +1,167 @@
+import heapq
+import itertools
+from collections import deque
+from threading import Condition, Lock
+
+OVERFLOW = ('drop_oldest', 'drop_newest', 'block', 'raise')
+
+
+class Full(Exception):
+    """Raised by Queue.add when the queue is full and the overflow policy is raise."""
+
+
 class Queue:
-    """Represents a Queue
+    """Represents a thread-safe Queue
+
+    FIFO and LIFO add and get in O(1) from a deque. PRIORITY gets the lowest priority first in O(log n) from a heap,
+    elements of equal priority come out in the order they were added. Waiting threads are only notified when there
+    are any, so an uncontended add or get costs one lock acquire.
 
     Attributes
     ----------
-    queue : list
-        Managed list
+    queue : deque or list
+        Managed elements. A heap of (priority, sequence, element) for PRIORITY
     style : str
-        Style of list management, i.e. FIFO or LIFO
+        Style of queue management, i.e. FIFO, LIFO or PRIORITY
+    dropped : int
+        Number of elements lost to the overflow policy
+
+    Parameters
+    ----------
+    style : str
+        FIFO, LIFO or PRIORITY
+    capacity : int
+        Optional maximum number of elements
+    overflow : str
+        What add does when the queue is full. drop_oldest removes the oldest element (the lowest priority one for
+        PRIORITY), drop_newest discards the new element, block waits for room and raise raises Full
 
     """
 
-    def __init__(self, style):
-        self.queue = []
+    def __init__(self, style='FIFO', capacity=None, overflow='drop_oldest'):
+        if style not in ('FIFO', 'LIFO', 'PRIORITY'):
+            raise ValueError('Unsupported queue style {}'.format(style))
+        if overflow not in OVERFLOW:
+            raise ValueError('Unsupported overflow policy {}'.format(overflow))
+
         self.style = style
+        self.capacity = capacity
+        self.overflow = overflow
+        self.queue = [] if style == 'PRIORITY' else deque()
+        self.sequence = itertools.count()  # Keeps equal priorities in insertion order
+        self.dropped = 0
+        self.lock = Lock()
+        self.condition = Condition(self.lock)
+        self.waiters = 0  # Threads blocked in add, get or drain
+
+    def add(self, element, priority=0, timeout=None):
+        """Adds element to the queue. Returns False if the element was discarded."""
+
+        with self.lock:
+            if self.capacity is not None and len(self.queue) >= self.capacity:
+                if self.overflow == 'raise':
+                    raise Full('Queue is full ({} elements)'.format(self.capacity))
+
+                elif self.overflow == 'drop_newest':
+                    self.dropped += 1
+                    return False
+
+                elif self.overflow == 'block':
+                    if not self.wait(lambda: not self.full(), timeout):
+                        self.dropped += 1
+                        return False
+
+                else:  # drop_oldest
+                    self.discard()
+                    self.dropped += 1
+
+            if self.style == 'PRIORITY':
+                heapq.heappush(self.queue, (priority, next(self.sequence), element))
+            else:
+                self.queue.append(element)
+            if self.waiters:
+                self.condition.notify_all()
+        return True
+
+    def get(self, block=False, timeout=None):
+        """Get the next element. Returns None when empty, after waiting up to timeout seconds if block is True."""
+
+        with self.lock:
+            if not self.queue and not (block and self.wait(lambda: len(self.queue) > 0, timeout)):
+                return None
+
+            element = self.queue.popleft() if self.style == 'FIFO' else self.pop()
+            if self.waiters:  # Room for blocked producers
+                self.condition.notify_all()
+            return element
+
+    def drain(self, max_items=None, block=False, timeout=None):
+        """Get up to max_items elements at once, all of them by default. Returns a list in get order."""
+
+        with self.lock:
+            if block and not self.queue:
+                self.wait(lambda: len(self.queue) > 0, timeout)
+
+            n = len(self.queue) if max_items is None else min(max_items, len(self.queue))
+            if self.style == 'FIFO' and n == len(self.queue):
+                elements = list(self.queue)
+                self.queue.clear()
+            else:
+                elements = [self.pop() for _ in range(n)]
+
+            if elements and self.waiters:
+                self.condition.notify_all()
+            return elements
+
+    def wait(self, predicate, timeout=None):
+        """Wait until predicate is True, with the lock held. Returns False on timeout."""
+
+        self.waiters += 1
+        try:
+            return self.condition.wait_for(predicate, timeout)
+        finally:
+            self.waiters -= 1
+
+    def pop(self):
+        if self.style == 'FIFO':
+            return self.queue.popleft()
+        elif self.style == 'LIFO':
+            return self.queue.pop()
+        return heapq.heappop(self.queue)[2]
+
+    def discard(self):
+        """Remove the oldest element, or the lowest priority one."""
+
+        if self.style != 'PRIORITY':
+            self.queue.popleft()
+        else:
+            self.queue.remove(max(self.queue))  # O(n), only when a full priority queue overflows
+            heapq.heapify(self.queue)
+
+    def promote(self, element, priority):
+        """PRIORITY only. Moves a queued element up to priority if that is more urgent. Returns True if it was queued.
 
-    def add(self, element):
-        """Adds element to the list"""
+        Among elements of the same priority it still comes out in the order it was added. O(n), meant for short queues.
+        """
 
-        if self.style == 'FIFO':  # If FIFO, append element to end of list
-            self.queue.append(element)
+        with self.lock:
+            for i, entry in enumerate(self.queue):
+                if entry[2] == element:
+                    if priority < entry[0]:
+                        self.queue[i] = (priority, entry[1], element)
+                        heapq.heapify(self.queue)
+                    return True
+            return False
 
-        elif self.style == 'LIFO':  # If LIFO, append element to front of list
-            self.queue.insert(0, element)
+    def full(self):
+        return self.capacity is not None and len(self.queue) >= self.capacity
 
-    def get(self):  # Get first item from list
-        if len(self.queue) > 0:
-            return self.queue.pop(0)
+    def __len__(self):  # Number of queued elements
+        return len(self.queue)
 
-    def __bool__(self):  # Return True if list is not empty. False if empty
+    def __bool__(self):  # Return True if queue is not empty. False if empty
         return len(self.queue) > 0
 
     def __repr__(self):  # List of elements
-        return ', '.join(self.queue)
+        elements = [entry[2] for entry in sorted(self.queue)] if self.style == 'PRIORITY' else self.queue
+        return ', '.join(str(element) for element in elements)
@@ -1,35 +1,333 @@
-import json
-from datetime import datetime
-from threading import Thread
+import asyncio
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 
 import paho.mqtt.client as mqtt
-from config.configurations import mosquitto_ip
+from config.configurations import mosquitto_ip, mosquitto_codec, mosquitto_keepalive, mosquitto_backoff
+from modules.payload_manager import encode
 
 
-class MQTT_Client:
-    def __init__(self, mosquitto_callback):
-        self.host_ip = mosquitto_ip
+class MQTT_Router:
+    """Single multiplexed broker connection shared by every MQTT_Client in the process.
+
+    Attributes
+    ----------
+    client : object
+        The one paho client (socket and network thread) used by the whole Home/Room/Thing tree
+
+    routes : dict
+        Dictionary defined as {topic_filter: [callbacks]}. Filters may contain + and # wildcards
+
+    matches : dict
+        Dictionary defined as {topic: [callbacks]}. Cache of resolved routes, so dispatch is a dict lookup
+
+    workers : object
+        Bounded thread pool that runs callbacks, so a slow handler never stalls the network thread
+
+    lanes : dict
+        Dictionary defined as {topic: deque of messages}. Messages of a topic are handled one at a time, in the order
+        they arrived, while different topics run in parallel
+
+    Parameters
+    ----------
+    host_ip : str
+        IP address of the mosquitto broker
+
+    workers : int
+        Number of threads used to run callbacks
+
+    root : str
+        Optional wildcard filter, i.e. home/#. When set, it is the only broker subscription and every
+        channel is routed locally.
+
+    keepalive : int
+        Seconds between pings. The broker publishes the last will after 1.5 times this without traffic
+
+    backoff : tuple
+        (first, longest) seconds between reconnect attempts on an attached event loop. The wait doubles after every
+        failed attempt. The network thread of listen() reconnects on its own
+
+    """
+
+    def __init__(self, host_ip=mosquitto_ip, workers=4, root=None, keepalive=mosquitto_keepalive,
+                 backoff=mosquitto_backoff):
+        self.host_ip = host_ip
+        self.root = root
+        self.keepalive = keepalive
+        self.presence = None  # (channel, function returning the online payload), see will()
         self.client = mqtt.Client()
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.dispatch
+        self.routes = dict()
+        self.matches = dict()
+        self.workers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mqtt')
+        self.lanes = dict()
+        self.lock = Lock()
+        self.connected = False
+        self.listening = False
+        self.loop = None  # Event loop when attached by Async_Runtime
+        self.misc = None
+        self.reconnecting = None
+        self.backoff = backoff
+
+    def connect(self):
+        """Connect to the broker once. Later calls reuse the open connection."""
+
+        with self.lock:
+            if not self.connected:
+                print('Connecting to broker... {}'.format(self.host_ip))
+                self.client.connect(self.host_ip, keepalive=self.keepalive)  # Connect to broker
+                self.connected = True
+        return 'Connected\n'
+
+    def will(self, channel, payload, online):
+        """Register the last will the broker publishes (retained) if this connection drops. Call before connect().
+
+        Parameters
+        ----------
+        channel : str
+            Presence channel of this process
+        payload : bytes
+            Offline message
+        online : function
+            Returns the online message, published on every (re)connect
+
+        """
+
+        self.client.will_set(channel, payload, qos=1, retain=True)
+        self.presence = (channel, online)
+
+    def on_connect(self, client, userdata, flags, rc):
+        """Re-subscribe every route and announce presence after a (re)connect."""
+
+        channels = [self.root] if self.root is not None else list(self.routes)
+        for channel in channels:
+            self.client.subscribe(channel, qos=1)
+
+        if self.presence is not None:
+            self.client.publish(self.presence[0], self.presence[1](), qos=1, retain=True)
+
+    def subscribe(self, channel, callback):
+        """Route messages matching channel to callback. Subscribes on the broker only for new filters."""
+
+        with self.lock:
+            new_filter = channel not in self.routes
+            self.routes.setdefault(channel, [])
+            if callback not in self.routes[channel]:
+                self.routes[channel].append(callback)
+            self.matches.clear()  # Routes changed, resolve topics again
+
+        if new_filter and self.root is None:
+            self.client.subscribe(channel, qos=1)
+
+    def unsubscribe(self, callback):
+        """Remove callback from every route and drop filters nobody listens to anymore."""
+
+        with self.lock:
+            empty = []
+            for channel in self.routes:
+                if callback in self.routes[channel]:
+                    self.routes[channel].remove(callback)
+                if not self.routes[channel]:
+                    empty.append(channel)
+
+            for channel in empty:
+                del self.routes[channel]
+            self.matches.clear()
+
+        if self.root is None:
+            for channel in empty:
+                self.client.unsubscribe(channel)
+
+    def route(self, topic):
+        """Returns the callbacks for a topic."""
+
+        callbacks = self.matches.get(topic)
+        if callbacks is None:  # First message on this topic, match against every filter
+            with self.lock:
+                callbacks = []
+                for channel in self.routes:
+                    if mqtt.topic_matches_sub(channel, topic):
+                        callbacks += [callback for callback in self.routes[channel] if callback not in callbacks]
+                self.matches[topic] = callbacks
+        return callbacks
+
+    def dispatch(self, client, userdata, message):
+        """Network thread callback. Hands the message to every matching callback, in order per topic."""
+
+        callbacks = self.route(message.topic)
+        if not callbacks:
+            return
+
+        if self.loop is not None:  # asyncio runtime, callbacks run on the event loop in arrival order
+            for callback in callbacks:
+                self.loop.call_soon(self.call, callback, client, userdata, message)
+            return
+
+        with self.lock:
+            lane = self.lanes.get(message.topic)
+            if lane is not None:  # A worker is draining this topic, it picks the message up
+                lane.append((callbacks, client, userdata, message))
+                return
+            self.lanes[message.topic] = deque([(callbacks, client, userdata, message)])
+        self.workers.submit(self.drain, message.topic)
+
+    def drain(self, topic):
+        """Worker. Runs the queued messages of a topic one after another."""
+
+        while True:
+            with self.lock:
+                lane = self.lanes[topic]
+                if not lane:
+                    del self.lanes[topic]
+                    return
+                callbacks, client, userdata, message = lane.popleft()
+
+            for callback in callbacks:
+                self.call(callback, client, userdata, message)
+
+    @staticmethod
+    def call(callback, client, userdata, message):
+        """Run a callback, logging its errors instead of losing them."""
+
+        try:
+            callback(client, userdata, message)
+        except Exception:
+            print('Callback for {} failed:\n{}'.format(message.topic, traceback.format_exc()))
+
+    def attach(self, loop):
+        """Drive the connection from an asyncio event loop instead of a network thread.
+
+        Must be called before connect(). The socket is watched with add_reader/add_writer and listen() no longer
+        starts a thread.
+        """
+
+        self.loop = loop
+        self.listening = True  # The event loop does the listening
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def on_loop(self, function, *args):
+        """Run function on the event loop. Socket callbacks also fire on the executor thread running reconnect()."""
+
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:  # Not on a loop
+            running = None
+
+        if running is self.loop:
+            function(*args)
+        elif not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(function, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        self.on_loop(self.socket_opened, sock)
+
+    def on_socket_close(self, client, userdata, sock):
+        self.on_loop(self.socket_closed, sock)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.on_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.on_loop(self.loop.remove_writer, sock)
+
+    def socket_opened(self, sock):
+        self.loop.add_reader(sock, self.client.loop_read)
+        self.misc = self.loop.create_task(self.misc_loop())
+
+    def socket_closed(self, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        if self.misc is not None and self.misc is not asyncio.current_task(self.loop):
+            self.misc.cancel()
+        self.misc = None
+        self.schedule_reconnect()
+
+    async def misc_loop(self):
+        """Keepalive pings and retries, the part of loop_forever that is not socket I/O."""
+
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+        self.schedule_reconnect()  # Connection lost without the socket being closed by paho
+
+    def schedule_reconnect(self):
+        """Start the reconnect loop, unless it is already running."""
+
+        if self.loop.is_closed():  # Runtime shut down
+            return
+        if self.reconnecting is None or self.reconnecting.done():
+            self.reconnecting = self.loop.create_task(self.reconnect_loop())
+
+    async def reconnect_loop(self):
+        """Reconnect with exponential backoff. on_socket_open watches the new socket, on_connect re-subscribes.
+
+        reconnect() blocks until the broker answers or the connection fails, so it runs on the loop's executor.
+        """
+
+        delay, longest = self.backoff
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                print('Reconnecting to broker... {}'.format(self.host_ip))
+                if await self.loop.run_in_executor(None, self.client.reconnect) == mqtt.MQTT_ERR_SUCCESS:
+                    return
+            except (OSError, ValueError) as error:  # Broker or network still down
+                print('Reconnect to {} failed: {}'.format(self.host_ip, error))
+            delay = min(delay * 2, longest)
+
+    def listen(self):
+        """Start the network thread once."""
+
+        with self.lock:
+            if not self.listening:
+                self.client.loop_start()
+                self.listening = True
+
+    def publish(self, channel, payload, qos=1, retain=True):
+        self.client.publish(channel, payload, qos=qos, retain=retain)
+
+
+router = None
+router_lock = Lock()
+
+
+def get_router():
+    """Returns the process-wide MQTT_Router, creating it on first use."""
+
+    global router
+    with router_lock:
+        if router is None:
+            router = MQTT_Router()
+    return router
+
+
+class MQTT_Client:
+    def __init__(self, mosquitto_callback, router=None, codec=mosquitto_codec):
+        self.router = get_router() if router is None else router
+        self.codec = codec
+        self.host_ip = self.router.host_ip
+        self.client = self.router.client
         self.mosquitto_callback = mosquitto_callback
         self.requests = dict()
 
     def connect(self):
-        """Connect to MQTT Broker and set callback."""
+        """Connect to MQTT Broker. The connection is shared with every other client in the process."""
 
-        print('Connecting to broker... {}'.format(self.host_ip))
-        self.client.connect(self.host_ip)  # Connect to broker
-        self.client.on_message = self.mosquitto_callback  # define callback
-        return 'Connected\n'
+        return self.router.connect()
 
     def listen(self, channels):
-        """Creates a sub-thread and actively listens to given channels."""
+        """Routes the given channels to this client's callback on the shared listening thread."""
 
         for channel in channels:  # Subscribe to every channel in the list
             print('Listening to... {}'.format(channel))
-            self.client.subscribe(channel, qos=1)
+            self.router.subscribe(channel, self.mosquitto_callback)
 
-        listen = Thread(target=self.client.loop_forever)  # Begin thread to loop forever.
-        listen.start()
+        self.router.listen()
 
         return 'Actively Listening for Mosquitto Broadcasts\n'
 
@@ -37,6 +335,6 @@ class MQTT_Client:
         """Broadcast payload to given channel."""
 
         print('\nBroadcasting on...\n{}\nPayload : {}'.format(channel, payload))
-        self.client.publish(channel, str(payload), qos=1, retain=True) # publish mosquitto to broker
+        self.router.publish(channel, encode(payload, self.codec), qos=1, retain=True)  # publish mosquitto to broker
 
         return '\nPayload sent'
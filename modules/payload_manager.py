@@ -0,0 +1,53 @@
+import ast
+import json
+
+try:  # Optional, only needed for the binary codec
+    import msgpack
+except ImportError:
+    msgpack = None
+
+CODECS = {'msgpack': b'\x01'}  # {codec: header byte}. Version 1 of the binary format
+HEADERS = {header[0]: codec for codec, header in CODECS.items()}
+
+
+def encode(payload, codec='json'):
+    """Encode a payload for MQTT. Returns bytes.
+
+    Parameters
+    ----------
+    payload : dict
+        Message to send
+
+    codec : str
+        json for strict, compact JSON (what the ESP firmware reads), or msgpack for the binary format.
+        Binary payloads start with a header byte so receivers can tell them apart from JSON
+
+    """
+
+    if codec == 'msgpack' and msgpack is not None:
+        return CODECS['msgpack'] + msgpack.packb(payload, use_bin_type=True)
+
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+
+def decode(data):
+    """Decode an MQTT payload of any supported format. Returns the message.
+
+    Parameters
+    ----------
+    data : bytes
+        Raw payload. A known header byte selects the binary codec, anything else is read as JSON.
+        Python dict strings from older firmware (single quotes) are still accepted, parsed without eval
+
+    """
+
+    if data and data[0] in HEADERS:
+        if msgpack is None:
+            raise ValueError('Received a {} payload but msgpack is not installed'.format(HEADERS[data[0]]))
+        return msgpack.unpackb(data[1:], raw=False)
+
+    text = data.decode('utf-8') if isinstance(data, (bytes, bytearray)) else data
+    try:
+        return json.loads(text)
+    except ValueError:  # Legacy str(dict) payload
+        return ast.literal_eval(text)
@@ -1,12 +1,23 @@
 import Adafruit_ADS1x15
 import Adafruit_DHT
 import RPi.GPIO as GPIO
-import json
+import time
+from collections import namedtuple
+
 import pandas as pd
 
 from modules.mosquitto_manager import MQTT_Client
+from modules.presence_manager import Presence
+from modules.payload_manager import decode
 from modules.miscellaneous import Queue
-from threading import Thread
+from threading import Thread, Lock
+
+
+BUSES = {'adc': 'adc', 'dht': 'dht'}  # {pin_type: bus}, every other pin type is read over GPIO
+
+EDGES = {'rising': 1, 'falling': 0}  # {pin_interrupt_on: pin value after the edge}, both reads the pin
+
+Pin = namedtuple('Pin', ['pin_id', 'pin_type', 'pin_sensor', 'pin_name', 'pin_up_down', 'pin_interrupt_on', 'bus'])
 
 
 def get_serial():
@@ -39,20 +50,57 @@ class MCU:
         Bounce time for pin reset
 
     interrupts : object
-        Object of type Queue, manages list of interrupts
+        Object of type Queue, bounded FIFO of (pin_id, level, timestamp) filled by the GPIO callback.
+        When full the oldest interrupt is dropped
+
+    counters : dict
+        Dictionary defined as {received, coalesced, processed}, interrupt counts since start.
+        Interrupts lost to overflow are counted by interrupts.dropped
+
+    pins : dict
+        Dictionary defined as {(bus, pin_id): Pin}, compiled once from data. ADC channels and GPIO pins are
+        numbered separately, so a pin is only unique on its bus
+
+    buses : dict
+        Dictionary defined as {bus: [Pin]}. Buses are gpio, adc and dht
+
+    dht : dict
+        Cache defined as {pin_id: (humidity, temperature, timestamp)}, refreshed by a background thread
 
     Parameters
     ----------
     data : dict
         Dictionary defined as {name_of_data: DataFrame}
+
+    dht_interval : int
+        Seconds between background DHT reads
+
+    dht_max_age : int
+        Oldest cached DHT reading a status response may use before reading the sensor inline
+
+    interrupt_capacity : int
+        Size of the interrupt ring buffer
     """
 
-    def __init__(self, data, interrupt_callback):
+    def __init__(self, data, interrupt_callback, dht_interval=10, dht_max_age=30, interrupt_capacity=64):
         print('Starting up the Raspberry Pi.')
         self.GPIO = GPIO  # Set attributes
         self.data = pd.DataFrame(data)
+        self.pins = dict()
+        for row in self.data.to_dict(orient='records'):  # Compile rows once
+            pin = Pin(*(row.get(field) for field in Pin._fields[:-1]), bus=BUSES.get(row['pin_type'], 'gpio'))
+            if (pin.bus, pin.pin_id) in self.pins:
+                raise ValueError('Pin {} is used twice on the {} bus'.format(pin.pin_id, pin.bus))
+            self.pins[(pin.bus, pin.pin_id)] = pin
+        self.buses = {bus: [pin for pin in self.pins.values() if pin.bus == bus] for bus in ('gpio', 'adc', 'dht')}
+        self.adc = None
+        self.dht = dict()
+        self.dht_lock = Lock()
+        self.dht_interval = dht_interval
+        self.dht_max_age = dht_max_age
         self.bounce_time = 8000
-        self.interrupts = Queue('LIFO')
+        self.interrupts = Queue('FIFO', capacity=interrupt_capacity, overflow='drop_oldest')
+        self.counters = dict.fromkeys(['received', 'coalesced', 'processed'], 0)
         self.interrupt_callback = interrupt_callback
 
     def start(self):
@@ -62,6 +110,9 @@ class MCU:
         self.GPIO.setwarnings(False)  # Turn off warnings
         self.GPIO.setmode(self.GPIO.BCM)  # Set references as BCM
         self.initialize()  # Initialize Raspberry Pi
+        if self.buses['dht']:
+            Thread(target=self.poll_dht, daemon=True).start()  # Keep DHT readings cached
+        Thread(target=self.process_interrupts, daemon=True).start()  # Interrupt worker
 
         return 'Raspberry Pi is up and running\n'
 
@@ -88,24 +139,53 @@ class MCU:
     def configure_interrupt(self, pin_id, interrupt_on):
         """Configures a software-based interrupt."""
 
-        if interrupt_on == 'rising':  # If pin value rises
-            self.GPIO.add_event_detect(pin_id, self.GPIO.RISING,
-                                       callback=self.interrupt_callback, bouncetime=self.bounce_time)
-        elif interrupt_on == 'falling':  # If pin value falls
-            self.GPIO.add_event_detect(pin_id, self.GPIO.RISING,
-                                       callback=self.interrupt_callback, bouncetime=self.bounce_time)
-        elif interrupt_on == 'both':  # If pin falls or rises
-            self.GPIO.add_event_detect(pin_id, self.GPIO.BOTH,
-                                       callback=self.interrupt_callback, bouncetime=self.bounce_time)
+        edges = {'rising': self.GPIO.RISING, 'falling': self.GPIO.FALLING, 'both': self.GPIO.BOTH}
+        if interrupt_on in edges:
+            self.GPIO.add_event_detect(pin_id, edges[interrupt_on],
+                                       callback=self.queue_interrupt, bouncetime=self.bounce_time)
+
+    def queue_interrupt(self, pin_id):
+        """GPIO callback. Records the level right after the edge, the worker publishes it.
+
+        A rising or falling edge sets the level. A pin on both edges is read here, before a short pulse can end.
+        """
+
+        level = EDGES.get(self.pins[('gpio', pin_id)].pin_interrupt_on)
+        if level is None:
+            level = self.GPIO.input(pin_id)
+        self.interrupts.add((pin_id, level, time.time()))
+        self.counters['received'] += 1
+
+    def process_interrupts(self):
+        """Worker thread. Takes every queued interrupt at once and passes them to interrupt_callback(result,
+        timestamp) in order. Only repeats of the same level in a row on a pin are coalesced, so every change of
+        level, i.e. both halves of a quick open/close, is published."""
+
+        while True:
+            batch = self.interrupts.drain(block=True)
+
+            levels = dict()  # {pin_id: last level in this batch}
+            for pin_id, level, timestamp in batch:
+                if levels.get(pin_id) == level:  # Repeat of the same level
+                    self.counters['coalesced'] += 1
+                    continue
+                levels[pin_id] = level
+
+                pin = self.pins[('gpio', pin_id)]
+                try:
+                    self.interrupt_callback(self.result(pin, pin.pin_sensor, level), timestamp)
+                    self.counters['processed'] += 1
+                except Exception as error:  # Keep the worker alive
+                    print('Interrupt on pin {} failed: {}'.format(pin_id, error))
 
     def initialize(self):
         """Initializes all the attached sensors."""
 
         print('Configuring pins...')
 
-        for pin in self.data.to_dict(orient='records'):  # iterate through each pin
-            self.configure_pin(pin['pin_id'], pin['pin_type'], pin['pin_up_down'])  # configure
-            self.configure_interrupt(pin['pin_id'], pin['pin_interrupt_on'])  # set interrupt
+        for pin in self.pins.values():  # iterate through each pin
+            self.configure_pin(pin.pin_id, pin.pin_type, pin.pin_up_down)  # configure
+            self.configure_interrupt(pin.pin_id, pin.pin_interrupt_on)  # set interrupt
 
     def read_write(self, query=None, read_write='read', write=None):
         """Reads or writes to the initialized sensors.
@@ -116,53 +196,104 @@ class MCU:
             to read specific: read_write('pin_name == "light1"')
             to write specific: read_write('pin_id == 1', 'write', 1)
 
+        Prefer read() and write() with (bus, pin_id) keys, they skip the DataFrame query.
         """
 
-        if query is None:  # Read all sensor if not specified
-            data = self.data
+        pins = None
+        if query is not None:  # Specify sensors
+            pins = [(BUSES.get(row['pin_type'], 'gpio'), row['pin_id'])
+                    for row in self.data.query(query).to_dict(orient='records')]
+
+        if read_write == 'write':
+            return self.write(pins, write)
+        return self.read(pins)
+
+    def read(self, keys=None):
+        """Read pins by (bus, pin_id), all of them if keys is None. GPIO pins first, then the ADC, then DHT from the
+        cache."""
+
+        if keys is None:
+            buses = self.buses
         else:
-            data = self.data.query(query)  # Specify sensors
-        value = int()  # Initialize empty value
-        n = len(data)  # Count total sensors
-        results = []  # Create empty list
-        for i in range(n):  # Iterate through each element
-            current_row = data[i:i + 1].to_dict(orient='records')[0]  # Look at current row
-
-            if read_write == 'write':  # If write
-                self.GPIO.output(current_row['pin_id'], int(write))  # Write value to pin
-
-            elif current_row['pin_type'] == 'adc':  # if sensor type is adc
-                value = Adafruit_ADS1x15.ADS1115().read_adc(current_row['pin_id'], gain=1)  # read adc value
-
-            elif current_row['pin_type'] == 'dht':  # If sensor type is dht
-                humidity, temperature = Adafruit_DHT.read(Adafruit_DHT.DHT11, current_row['pin_id'])
-                if humidity is None and temperature is None:
-                    humidity, temperature = 0.0, 0.0
-                value = {'humidity': humidity, 'temperature': temperature}  # read humidity and temperature
-            else:
-                value = self.GPIO.input(current_row['pin_id'])  # Read pin value
-
-            if isinstance(value, dict):  # If value read has multiple parts, break apart based on sensor name number
-                for val in value:  # iterate through read values
-                    result = {
-                        'sensor_name': current_row['pin_name'],
-                        'sensor_type': val,
-                        'sensor_pin': current_row['pin_id'],
-                        'sensor_value': value[val]
-                    }
-
-                    results.append(result)
-            else:
-                result = {
-                    'sensor_name': current_row['pin_name'],
-                    'sensor_type': current_row['pin_sensor'],
-                    'sensor_pin': current_row['pin_id'],
-                    'sensor_value': value
-                    }
-                results.append(result)
+            pins = [self.pins[key] for key in keys]
+            buses = {bus: [pin for pin in pins if pin.bus == bus] for bus in self.buses}
+
+        results = []
+        for pin in buses['gpio']:
+            results.append(self.result(pin, pin.pin_sensor, self.GPIO.input(pin.pin_id)))
+
+        for pin in buses['adc']:
+            results.append(self.result(pin, pin.pin_sensor, self.get_adc().read_adc(pin.pin_id, gain=1)))
+
+        for pin in buses['dht']:
+            humidity, temperature = self.read_dht(pin.pin_id)
+            results.append(self.result(pin, 'humidity', humidity))
+            results.append(self.result(pin, 'temperature', temperature))
 
         return results
 
+    def write(self, keys, value):
+        """Write a value to output pins by (bus, pin_id), all of them if keys is None."""
+
+        pins = self.buses['gpio'] if keys is None else [self.pins[key] for key in keys]
+        results = []
+        for pin in pins:
+            self.GPIO.output(pin.pin_id, int(value))  # Write value to pin
+            results.append(self.result(pin, pin.pin_sensor, int(value)))
+        return results
+
+    @staticmethod
+    def result(pin, sensor_type, value):
+        return {
+            'sensor_name': pin.pin_name,
+            'sensor_type': sensor_type,
+            'sensor_pin': pin.pin_id,
+            'sensor_value': value
+        }
+
+    def get_adc(self):
+        """Returns the ADS1115 driver, created once."""
+
+        if self.adc is None:
+            self.adc = Adafruit_ADS1x15.ADS1115()
+        return self.adc
+
+    def read_dht(self, pin_id):
+        """Returns (humidity, temperature) from the cache, reading the sensor only if the cache is too old."""
+
+        cached = self.dht.get(pin_id)
+        if cached is None or time.time() - cached[2] > self.dht_max_age:
+            cached = self.refresh_dht(pin_id, self.dht_max_age)
+        return cached[0], cached[1]
+
+    def refresh_dht(self, pin_id, max_age=None):
+        """Read a DHT sensor and cache it. A failed read keeps the last good values.
+
+        Sensors are read one at a time. A reading cached less than max_age seconds ago by another thread, while
+        this one waited, is returned without reading the sensor again.
+        """
+
+        with self.dht_lock:
+            cached = self.dht.get(pin_id)
+            if max_age is not None and cached is not None and time.time() - cached[2] <= max_age:
+                return cached
+
+            humidity, temperature = Adafruit_DHT.read(Adafruit_DHT.DHT11, pin_id)
+            if humidity is None and temperature is None:
+                previous = self.dht.get(pin_id, (0.0, 0.0, 0))
+                humidity, temperature = previous[0], previous[1]
+
+            self.dht[pin_id] = (humidity, temperature, time.time())
+            return self.dht[pin_id]
+
+    def poll_dht(self):
+        """Background thread. Keeps the DHT cache fresh so status requests never wait on the sensor."""
+
+        while True:
+            for pin in self.buses['dht']:
+                self.refresh_dht(pin.pin_id)
+            time.sleep(self.dht_interval)
+
 
 class Thing_Main:
     """Represents an active MCU
@@ -175,6 +306,9 @@ class Thing_Main:
     r_pi : object
         Class object of type MCU
 
+    presence : object
+        Object of type Presence. Announces this thing online, and offline through the MQTT last will
+
     Parameters
     ----------
     credentials : dict
@@ -187,6 +321,7 @@ class Thing_Main:
     def __init__(self, data):
         self.mqtt_data = data.pop('mqtt_data')
         self.mosquitto = MQTT_Client(self.mosquitto_callback)
+        self.presence = Presence(data['thing_id'], track=False)  # Last will is registered before connecting
         self.r_pi = MCU(data.pop('sensor_data'), self.interrupt_callback)  # Initialize raspberry pi
         self.data = data
 
@@ -195,35 +330,27 @@ class Thing_Main:
         print('Initializing {} | {}'.format(self.__class__.__name__, self.data['name']))
         print(self.mosquitto.connect())  # Log info
         print(self.mosquitto.listen(self.mqtt_data['subscribe']))  # Log info
+        self.presence.start()  # Heartbeats
         print(self.r_pi.start())  # Start up the RPI
 
-    def interrupt_callback(self, pin):
-        """Process active interrupt."""
-        # TODO accommodate interrupts that occur when value is dropping
-        print('Processing Interrupt for {}'.__class__.__name__)  # Call super class
-
-        result = self.r_pi.read_write('pin_id == {}'.format(pin))[0]  # Read pin value
-
-        # THIS LINE NEEDS TO BE DYNAMIC TO EITHER RISING OR DROPPING
-        val = [0, 1][self.r_pi.data.query('pin_id == {}'.format(pin))['pin_interrupt_on'].to_list()[0] ==
-                     'rising']  # check if it matches interrupt
+    def interrupt_callback(self, result, timestamp):
+        """Publish an interrupt. Runs on the MCU interrupt worker, not the GPIO thread."""
+        print('Processing Interrupt for {}'.format(result['sensor_name']))
 
-        if result['sensor_value'] == val:  # if interrupt values match
-            payload = {
-                'thing_id': self.data['thing_id'],
-                'thing_name': self.data['name'],
-                'interrupt': result
-            }
+        payload = {
+            'thing_id': self.data['thing_id'],
+            'thing_name': self.data['name'],
+            'timestamp': timestamp,
+            'interrupt': result
+        }
 
-            self.mosquitto.broadcast(self.mqtt_data['interrupt'], payload)
+        self.mosquitto.broadcast(self.mqtt_data['interrupt'], payload)
 
     def mosquitto_callback(self, client, userdata, message):
         """Mosquitto callback function."""
-        msg = message.payload.decode("utf-8")  # Decode message
+        msg = decode(message.payload)  # Decode JSON or binary payload to dictionary
         topic = message.topic  # Get topic
         print('\n{} Received message!\n{}\n{}\n'.format(self.data['name'], topic, msg))
-        msg = msg.replace("'", "\"")  # Replace single for double quotes
-        msg = json.loads(msg)  # convert string to dictionary
 
         if 'request' in topic:  # If request
             if msg['request'] == 'status':
@@ -0,0 +1,130 @@
+import asyncio
+import time
+from threading import Thread, Lock
+
+from config.configurations import presence
+from modules.mosquitto_manager import get_router
+from modules.payload_manager import encode, decode
+
+
+class Presence:
+    """Online/offline state of every device, from retained presence messages, heartbeats and MQTT last wills.
+
+    Every process announces itself on topic/<device_id>: online when it connects and on every heartbeat, offline
+    when it stops. The broker publishes offline as the connection's last will when the process dies or loses its
+    network, so nobody has to wait on a timeout to find out.
+
+    Attributes
+    ----------
+    devices : dict
+        Dictionary defined as {device_id: [online, last seen]}, last seen in monotonic seconds. Only devices that
+        published on the presence topic are listed
+
+    Parameters
+    ----------
+    device_id : str
+        ID this process announces, i.e. the home ID on the hub or the Pi's serial
+    router : object
+        Object of type MQTT_Router. Defaults to the process-wide router
+    topic : str
+        Presence topic prefix
+    heartbeat : int
+        Seconds between heartbeats
+    timeout : int
+        Seconds without a heartbeat or any other message before a device counts as offline
+    track : bool
+        Listen to the presence of other devices. Things only announce themselves
+
+    """
+
+    def __init__(self, device_id, router=None, topic=presence['topic'], heartbeat=presence['heartbeat'],
+                 timeout=presence['timeout'], track=True):
+        self.device_id = device_id
+        self.router = get_router() if router is None else router
+        self.topic = topic
+        self.heartbeat = heartbeat
+        self.timeout = timeout
+        self.track = track
+        self.devices = dict()
+        self.lock = Lock()
+        self.running = False
+
+        # The last will has to be registered before the connection is opened
+        self.router.will('{}/{}'.format(topic, device_id), self.payload(False), self.payload)
+
+    def payload(self, online=True):
+        return encode({'device_id': self.device_id, 'state': 'online' if online else 'offline',
+                       'timestamp': time.time()}, 'json')
+
+    def start(self, loop=None):
+        """Listen to other devices and start the heartbeat, on loop when given, otherwise on a thread."""
+
+        if self.running:
+            return self
+        self.running = True
+
+        if self.track:
+            self.router.subscribe('{}/+'.format(self.topic), self.callback)
+        if loop is not None:
+            loop.create_task(self.async_beat())
+        else:
+            Thread(target=self.beat, daemon=True).start()
+        return self
+
+    def stop(self):
+        """Announce a clean shutdown. The last will only covers unexpected disconnects."""
+        self.running = False
+        self.router.publish('{}/{}'.format(self.topic, self.device_id), self.payload(False))
+
+    def beat(self):
+        while self.running:
+            time.sleep(self.heartbeat)
+            if self.running:
+                self.router.publish('{}/{}'.format(self.topic, self.device_id), self.payload())
+
+    async def async_beat(self):
+        while self.running:
+            await asyncio.sleep(self.heartbeat)
+            if self.running:
+                self.router.publish('{}/{}'.format(self.topic, self.device_id), self.payload())
+
+    def callback(self, client, userdata, message):
+        """Mosquitto callback for the presence topic."""
+
+        msg = decode(message.payload)
+        device_id = message.topic.rsplit('/', 1)[-1]
+        if device_id != self.device_id:
+            self.update(device_id, msg.get('state') == 'online')
+
+    def update(self, device_id, online):
+        with self.lock:
+            self.devices[device_id] = [online, time.monotonic()]
+
+    def seen(self, device_id):
+        """Any message from a device that announces its presence counts as a heartbeat.
+
+        Devices that never announced are not tracked, so they are not held to the heartbeat timeout.
+        """
+
+        with self.lock:
+            entry = self.devices.get(device_id)
+            if entry is not None:
+                entry[0], entry[1] = True, time.monotonic()
+
+    def is_online(self, device_id):
+        """True unless the device announced offline or missed its heartbeats.
+
+        Devices that never announced themselves (i.e. firmware without presence) are assumed online.
+        """
+
+        entry = self.devices.get(device_id)
+        if entry is None:
+            return True
+        return entry[0] and time.monotonic() - entry[1] < self.timeout
+
+    def online(self):
+        """Returns the IDs of devices that are online."""
+        return [device_id for device_id in list(self.devices) if self.is_online(device_id)]
+
+    def __repr__(self):
+        return '{} devices, {} online'.format(len(self.devices), len(self.online()))
@@ -0,0 +1,127 @@
+import time
+import uuid
+from concurrent.futures import Future, InvalidStateError, TimeoutError
+from threading import Lock
+
+
+class Request_Manager:
+    """Correlates outgoing requests with their responses.
+
+    Every request is given a unique ID and a Future. The Future is completed by the mosquitto callback once a
+    message arrives on a response channel, so callers block on an event instead of spinning.
+
+    Attributes
+    ----------
+    pending : dict
+        Dictionary defined as {request_id: Future}
+
+    """
+
+    def __init__(self):
+        self.pending = dict()
+        self.lock = Lock()
+
+    def open(self):
+        """Register a new request. Returns a tuple defined as (request_id, Future)."""
+
+        request_id = uuid.uuid4().hex  # Unique even when requests share the same second
+        future = Future()
+        with self.lock:
+            self.pending[request_id] = future
+        return request_id, future
+
+    def resolve(self, request_id, response):
+        """Complete a pending request. Returns True if a caller was waiting, False for late or unknown IDs."""
+
+        with self.lock:
+            future = self.pending.pop(request_id, None)
+
+        if future is None:
+            return False
+
+        try:
+            future.set_result(response)
+        except InvalidStateError:  # Cancelled while the response was in flight
+            return False
+        return True
+
+    def wait(self, request_id, future, timeout=None):
+        """Block until the response arrives. Raises TimeoutError and forgets the request if none arrives in time."""
+
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            self.cancel(request_id)
+            raise
+
+    def cancel(self, request_id):
+        """Cancel a single pending request. Returns True if it was pending."""
+
+        with self.lock:
+            future = self.pending.pop(request_id, None)
+
+        return future is not None and future.cancel()
+
+    def cancel_all(self):
+        """Cancel every pending request. Returns the number of cancelled requests."""
+
+        with self.lock:
+            pending, self.pending = self.pending, dict()
+
+        return sum(future.cancel() for future in pending.values())
+
+    def __len__(self):  # Number of requests still waiting for a response
+        return len(self.pending)
+
+    def __repr__(self):
+        return '{} pending requests'.format(len(self))
+
+
+class Device_Health:
+    """Tracks which devices answer requests, so fan-outs stop waiting on devices that are known to be down.
+
+    A device that misses a request is backed off: it is skipped until its retry time, then probed once. Every miss in
+    a row doubles the back off, up to max_backoff. An answer clears it.
+
+    Attributes
+    ----------
+    devices : dict
+        Dictionary defined as {device_id: [consecutive misses, last answer, retry time]}, monotonic seconds
+
+    Parameters
+    ----------
+    backoff : int
+        Seconds a device is skipped after its first miss
+    max_backoff : int
+        Longest a device is skipped
+
+    """
+
+    def __init__(self, backoff=30, max_backoff=600):
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.devices = dict()
+        self.lock = Lock()
+
+    def available(self, device_id):
+        """True unless the device is backed off."""
+
+        entry = self.devices.get(device_id)
+        return entry is None or entry[0] == 0 or time.monotonic() >= entry[2]
+
+    def success(self, device_id):
+        with self.lock:
+            self.devices[device_id] = [0, time.monotonic(), 0]
+
+    def failure(self, device_id):
+        with self.lock:
+            entry = self.devices.setdefault(device_id, [0, None, 0])
+            entry[0] += 1
+            entry[2] = time.monotonic() + min(self.backoff * 2 ** (entry[0] - 1), self.max_backoff)
+
+    def offline(self):
+        """Returns the IDs of devices that missed their last request."""
+        return [device_id for device_id, entry in self.devices.items() if entry[0] > 0]
+
+    def __repr__(self):
+        return '{} devices, {} offline'.format(len(self.devices), len(self.offline()))
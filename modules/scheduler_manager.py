@@ -0,0 +1,229 @@
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Condition
+
+
+class Timer_Handle:
+    """A pending call in the Scheduler.
+
+    Attributes
+    ----------
+    key : hashable
+        Unique key of the timer, i.e. (device_id, rule_id). Scheduling the same key replaces the timer
+
+    due : float
+        Epoch seconds when the call runs
+
+    payload : dict
+        Optional JSON serializable description of the call, used to restore it after a restart
+
+    """
+
+    def __init__(self, key, due, function, args, payload):
+        self.key = key
+        self.due = due
+        self.function = function
+        self.args = args
+        self.payload = payload
+        self.cancelled = False
+        self.timer = None  # asyncio TimerHandle when run by Async_Scheduler
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __repr__(self):
+        return '{} in {:.1f}s'.format(self.key, self.due - time.time())
+
+
+class Scheduler(Thread):
+    """One thread that runs every timer of the home from a heap.
+
+    Attributes
+    ----------
+    timers : dict
+        Dictionary defined as {key: Timer_Handle}, pending timers only
+
+    heap : list
+        Heap of (due, sequence, Timer_Handle). Cancelled handles are skipped when they reach the top
+
+    Parameters
+    ----------
+    path : str
+        Optional JSON file the pending timers with a payload are saved to, so they survive a restart
+
+    workers : int
+        Number of threads that run due calls, so a slow call never delays other timers
+
+    """
+
+    def __init__(self, path=None, workers=2):
+        super().__init__(daemon=True)
+        self.path = path
+        self.timers = dict()
+        self.heap = []
+        self.sequence = itertools.count()  # Tie breaker for equal due times
+        self.condition = Condition()
+        self.workers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='timer')
+        self.dirty = False
+        self.saved = 0
+
+    def schedule(self, key, delay, function, args=(), payload=None):
+        """Run function(*args) after delay seconds, replacing any pending timer with the same key."""
+
+        handle = Timer_Handle(key, time.time() + delay, function, args, payload)
+        with self.condition:
+            previous = self.timers.get(key)
+            if previous is not None:
+                previous.cancel()
+
+            self.timers[key] = handle
+            heapq.heappush(self.heap, (handle.due, next(self.sequence), handle))
+            self.dirty = self.dirty or payload is not None or (previous is not None and previous.payload is not None)
+            self.condition.notify()  # The new timer may be due before the one the thread waits on
+        return handle
+
+    def cancel(self, key):
+        """Cancel a pending timer. Returns True if there was one."""
+
+        with self.condition:
+            handle = self.timers.pop(key, None)
+            if handle is None:
+                return False
+
+            handle.cancel()
+            self.dirty = self.dirty or handle.payload is not None
+            return True
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.heap or self.heap[0][2].cancelled:
+                    if self.heap:  # Drop cancelled timers
+                        heapq.heappop(self.heap)
+                        continue
+                    self.save()
+                    self.condition.wait(timeout=1 if self.dirty else None)
+
+                due, _, handle = self.heap[0]
+                wait = due - time.time()
+                if wait > 0:
+                    self.save()
+                    self.condition.wait(timeout=wait if not self.dirty else min(wait, 1))
+                    continue
+
+                heapq.heappop(self.heap)
+                if self.timers.get(handle.key) is handle:
+                    del self.timers[handle.key]
+                    self.dirty = self.dirty or handle.payload is not None
+
+            self.workers.submit(handle.function, *handle.args)
+
+    def save(self):
+        """Write the pending timers with a payload to disk. Runs at most once a second, under the lock."""
+
+        if self.path is None or not self.dirty or time.time() - self.saved < 1:
+            return
+
+        pending = [{'key': list(handle.key) if isinstance(handle.key, tuple) else handle.key,
+                    'due': handle.due, 'payload': handle.payload}
+                   for handle in self.timers.values() if handle.payload is not None]
+
+        with open(self.path + '.tmp', 'w') as file:
+            json.dump(pending, file)
+        os.replace(self.path + '.tmp', self.path)  # Never leave a half written schedule
+        self.dirty = False
+        self.saved = time.time()
+
+    def restore(self, resolve):
+        """Re-schedule timers saved by a previous run. Overdue timers run right away.
+
+        Parameters
+        ----------
+        resolve : function
+            Called with a payload, returns (function, args) or None if the timer no longer applies
+
+        """
+
+        if self.path is None or not os.path.exists(self.path):
+            return 0
+
+        with open(self.path) as file:
+            pending = json.load(file)
+
+        restored = 0
+        for timer in pending:
+            call = resolve(timer['payload'])
+            if call is not None:
+                key = tuple(timer['key']) if isinstance(timer['key'], list) else timer['key']
+                self.schedule(key, max(0, timer['due'] - time.time()), call[0], call[1], timer['payload'])
+                restored += 1
+        return restored
+
+    def __len__(self):  # Number of pending timers
+        return len(self.timers)
+
+    def __repr__(self):
+        return '{} pending timers'.format(len(self))
+
+
+class Async_Scheduler(Scheduler):
+    """Scheduler that runs its timers on an asyncio event loop instead of a thread.
+
+    Same interface and persistence as Scheduler. Calls run on the event loop, so they must not block.
+
+    Parameters
+    ----------
+    loop : object
+        The asyncio event loop
+
+    path : str
+        Optional JSON file the pending timers with a payload are saved to
+
+    """
+
+    def __init__(self, loop, path=None, workers=None):
+        super().__init__(path, workers=1)
+        self.loop = loop
+
+    def schedule(self, key, delay, function, args=(), payload=None):
+        handle = Timer_Handle(key, time.time() + delay, function, args, payload)
+        with self.condition:
+            previous = self.timers.get(key)
+            if previous is not None:
+                previous.cancel()
+                if previous.timer is not None:
+                    self.loop.call_soon_threadsafe(previous.timer.cancel)
+
+            self.timers[key] = handle
+            self.dirty = self.dirty or payload is not None or (previous is not None and previous.payload is not None)
+
+        self.loop.call_soon_threadsafe(self.arm, handle)  # Safe from any thread
+        return handle
+
+    def arm(self, handle):
+        if not handle.cancelled:
+            handle.timer = self.loop.call_later(max(0, handle.due - time.time()), self.fire, handle)
+
+    def fire(self, handle):
+        with self.condition:
+            if self.timers.get(handle.key) is handle:
+                del self.timers[handle.key]
+                self.dirty = self.dirty or handle.payload is not None
+
+        if not handle.cancelled:
+            handle.function(*handle.args)
+
+    def start(self):
+        """Start saving the schedule from the event loop. There is no thread to start."""
+        self.loop.create_task(self.autosave())
+
+    async def autosave(self):
+        while True:
+            with self.condition:
+                self.save()
+            await asyncio.sleep(1)
@@ -1,49 +1,185 @@
+import difflib
+import hashlib
+import os
 import random
 import time
+from threading import Thread, Lock
 from soco import SoCo
 import re
 import pyttsx3
 
+from modules.miscellaneous import Queue
+
 
 class Sonos:
-    """SoCo class container."""
+    """SoCo class container.
+
+    Announcements are queued and spoken one at a time by a worker thread, so callers never wait on the speaker.
+    Synthesized clips are kept on the shared drive, named by a hash of message, voice and rate, and reused.
+
+    Attributes
+    ----------
+    announcements : object
+        Object of type Queue, pending (message, volume) announcements
+
+    clips : dict
+        Dictionary defined as {clip key: estimated duration in seconds}, clips already on the shared drive
+
+    playlists : dict
+        Dictionary defined as {normalized name: uri} of Sonos playlists and favorites, refreshed every refresh seconds
+
+    Parameters
+    ----------
+    ip_address : str
+        IP address of the speaker
+
+    clip_folder : str
+        Local folder of the shared drive the clips are written to
+
+    clip_share : str
+        The same folder as the speaker sees it
+
+    refresh : int
+        Seconds between playlist index refreshes
+
+    """
 
-    def __init__(self, ip_address):
+    def __init__(self, ip_address, clip_folder='/home/gerardo/IoT/audio_clips',
+                 clip_share='x-file-cifs://192.168.50.173/Share', voice='english+m7', rate=125, refresh=600):
         self.player = SoCo(ip_address)
         self.engine = pyttsx3.init()
-        self.engine.setProperty('voice', 'english+m7')
-        self.engine.setProperty('rate', 125)
+        self.voice = voice
+        self.rate = rate
+        self.engine.setProperty('voice', voice)
+        self.engine.setProperty('rate', rate)
+
+        self.clip_folder = clip_folder  # Add this folder to shared drive
+        self.clip_share = clip_share
+        self.clips = dict()
+        self.announcements = Queue('FIFO', capacity=16, overflow='drop_oldest')
+        Thread(target=self.announce_queue, daemon=True).start()
+
+        self.playlists = dict()
+        self.lookups = dict()  # {requested name: normalized name}, fuzzy matches already made
+        self.refresh = refresh
+        self.refreshed = 0
+        Thread(target=self.keep_playlists, daemon=True).start()
+
+    @staticmethod
+    def normalize(name):
+        """Lower case letters and digits separated by single spaces, i.e. 'Chill Vibes!' -> 'chill vibes'."""
+        return ' '.join(re.sub(r'[^0-9a-z]+', ' ', str(name).lower()).split())
+
+    def load_playlists(self):
+        """Index the Sonos playlists and favorites by normalized name. Returns the number indexed."""
+
+        items = list(self.player.get_sonos_playlists())
+        try:
+            items += list(self.player.music_library.get_sonos_favorites())
+        except Exception as error:  # Favorites are optional, playlists still work
+            print('Could not read Sonos favorites: {}'.format(error))
+
+        playlists = dict()
+        for item in items:
+            try:
+                playlists.setdefault(self.normalize(item.title), item.resources[0].uri)  # Playlists win over favorites
+            except (AttributeError, IndexError):  # Favorites without a playable resource
+                continue
+
+        self.playlists = playlists
+        self.lookups = dict()
+        self.refreshed = time.time()
+        return len(playlists)
+
+    def keep_playlists(self):
+        """Background thread. Reloads the playlist index every refresh seconds."""
+
+        while True:
+            try:
+                self.load_playlists()
+            except Exception as error:  # Speaker unreachable, keep the last index
+                print('Could not read Sonos playlists: {}'.format(error))
+            time.sleep(self.refresh)
+
+    def find_playlist(self, playlist):
+        """Returns the uri of a playlist or favorite by name: exact, then contained, then the closest match."""
+
+        if not self.refreshed:  # Index not loaded yet
+            self.load_playlists()
+
+        name = self.normalize(playlist)
+        if name in self.playlists:
+            return self.playlists[name]
+
+        if name not in self.lookups:
+            contained = [candidate for candidate in self.playlists if name in candidate]
+            close = contained or difflib.get_close_matches(name, self.playlists, n=1, cutoff=0.6)
+            self.lookups[name] = min(close, key=len) if close else None
+        return self.playlists.get(self.lookups[name])
+
+    def clip(self, message):
+        """Returns (uri, duration) of the spoken message, synthesizing it only the first time."""
+
+        key = hashlib.sha1('{}|{}|{}'.format(message, self.voice, self.rate).encode('utf-8')).hexdigest()[:16]
+        file_name = '{}.mp3'.format(key)
+        path = os.path.join(self.clip_folder, file_name)
+
+        if key not in self.clips:
+            if not os.path.exists(path):  # New message, synthesize it once
+                self.engine.save_to_file(message, path)
+                self.engine.runAndWait()
+                self.player.music_library.start_library_update()
+                time.sleep(.5)
+            self.clips[key] = max(2, len(message) / 6)  # Estimate the duration of the voice response
+
+        return '{}/{}'.format(self.clip_share, file_name), self.clips[key]
 
     def tts(self, message):
-        """Sends and plays string message using pyttsx3 library"""
+        """Sends and plays string message using pyttsx3 library. Returns the estimated duration."""
+
+        uri, duration = self.clip(message)
+        self.player.play_uri(uri)
+        return duration
+
+    def announce(self, message, volume=10):
+        """Queue a message to speak, volume steps louder than the music. Returns right away."""
+        self.announcements.add((message, volume))
+
+    def announce_queue(self):
+        """Worker thread. Speaks queued announcements one after another."""
 
-        self.engine.save_to_file(message, '/home/gerardo/IoT/audio_clips/voice.mp3')  # Add this folder to shared drive
-        self.player.music_library.start_library_update()
-        time.sleep(.5)
-        self.player.play_uri('x-file-cifs://192.168.50.173/Share/voice.mp3')
+        while True:
+            message, volume = self.announcements.get(block=True)
+            try:
+                self.speak(message, volume)
+            except Exception as error:  # Speaker unreachable, keep the worker alive
+                print('Sonos announcement "{}" failed: {}'.format(message, error))
 
-    def speak(self, message):
+    def speak(self, message, volume=0):
+        """Speak a message now, then resume what was playing. Blocks until the message is spoken."""
 
         current_transport_info = self.player.get_current_transport_info()[u'current_transport_state']
-        current_position = self.player.get_current_track_info()[u'position']
-        current_title = self.player.get_current_track_info()[u'title']
-        current_uri = self.player.get_current_track_info()[u'uri']
-        current_metadata = self.player.get_current_track_info()[u'metadata']
+        track = self.player.get_current_track_info()  # One snapshot of the player
+        current_position = track[u'position']
+        current_title = track[u'title']
+        current_uri = track[u'uri']
+        current_metadata = track[u'metadata']
         if 'spotify' in current_metadata:
-            start = re.search('x-sonos-spotify',current_metadata)
+            start = re.search('x-sonos-spotify', current_metadata)
             end = re.search('sid=12', current_metadata)
-            print(start.start(), end.start())
-            print(current_metadata)
-            current_uri = current_metadata[start.start():end.start()+6]
+            if start is not None and end is not None:
+                current_uri = current_metadata[start.start():end.start()+6]
 
-        duration = max(2, len(message) / 6)     # Estimate the duration of the voice response
-        self.tts(message)
-        time.sleep(duration)
-        self.player.stop()
+        self.player.volume += volume
+        try:
+            duration = self.tts(message)
+            time.sleep(duration)
+            self.player.stop()
+        finally:
+            self.player.volume -= volume
 
         if current_transport_info == "PLAYING":
             print('Sonos was playing {}. Starting from the paused position.' .format(current_title))
-            print(current_uri)
             self.player.play_uri(current_uri)
             self.player.seek(current_position)
             self.player.play()
@@ -56,17 +192,31 @@ class Sonos:
 
     def listen(self, playlist='random'):
         print('Listening to {}'.format(playlist))
+        if playlist == 'random':
+            if not self.refreshed:
+                self.load_playlists()
+            uri = random.choice(list(self.playlists.values())) if self.playlists else None
+        else:
+            uri = self.find_playlist(playlist)
+
+        if uri is None:
+            print('No Sonos playlist matches {}'.format(playlist))
+            return
+
         self.player.stop()
         self.player.clear_queue()
-        favorites = self.player.get_sonos_playlists()
-        if playlist != 'random':
-            for track in range(len(favorites)):
-                name = str(favorites[track])
-                if playlist in name:
-                    self.player.add_uri_to_queue(favorites[track].resources[0].uri)
-                    self.player.play()
+        self.player.add_uri_to_queue(uri)
+        self.player.play()
 
-        else:
-            random_playlist = random.choice(favorites)
-            self.player.add_uri_to_queue(random_playlist.resources[0].uri)
-            self.player.play()
+
+speakers = dict()  # {ip_address: Sonos}, one announcement queue and playlist index per speaker in the process
+speakers_lock = Lock()
+
+
+def get_sonos(ip_address, **options):
+    """Returns the shared Sonos client for a speaker, creating it on first use."""
+
+    with speakers_lock:
+        if ip_address not in speakers:
+            speakers[ip_address] = Sonos(ip_address, **options)
+        return speakers[ip_address]
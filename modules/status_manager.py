@@ -0,0 +1,168 @@
+import time
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+
+
+class Column:
+    """Readings of a single sensor type stored in contiguous NumPy arrays.
+
+    Attributes
+    ----------
+    values : ndarray
+        Latest value per sensor, only the first size entries are in use
+
+    timestamps : ndarray
+        Epoch seconds of each latest value
+
+    keys : list
+        List of keys defined as (thing_id, sensor_name, sensor_type), in slot order
+
+    """
+
+    def __init__(self, capacity):
+        self.values = np.full(capacity, np.nan)
+        self.timestamps = np.zeros(capacity)
+        self.keys = []
+        self.size = 0
+
+    def add(self, key):
+        """Reserve a slot for a new sensor. Returns its position."""
+
+        if self.size == len(self.values):  # Full, double the capacity
+            self.values = np.concatenate([self.values, np.full(self.size, np.nan)])
+            self.timestamps = np.concatenate([self.timestamps, np.zeros(self.size)])
+
+        self.keys.append(key)
+        self.size += 1
+        return self.size - 1
+
+
+class Status_Store:
+    """Live sensor state updated incrementally from interrupts and responses.
+
+    Readings are keyed by (thing_id, sensor_name, sensor_type), since a DHT sensor reports temperature and humidity
+    under one sensor_name. Values of a sensor type are contiguous, so reading a type is a zero-copy view.
+
+    Attributes
+    ----------
+    parent : object
+        Optional Status_Store of the parent room or home. Every update is forwarded to it
+
+    slots : dict
+        Dictionary defined as {(thing_id, sensor_name, sensor_type): position in the sensor type column}
+
+    columns : dict
+        Dictionary defined as {sensor_type: Column}
+
+    names : dict
+        Dictionary defined as {sensor_name: [(sensor_type, position)]}
+
+    history : object
+        Optional History that records every update, usually attached to the home's store only
+
+    Parameters
+    ----------
+    parent : object
+        Status_Store to forward updates to
+
+    capacity : int
+        Initial number of sensors per sensor type
+
+    """
+
+    def __init__(self, parent=None, capacity=8):
+        self.parent = parent
+        self.capacity = capacity
+        self.slots = dict()
+        self.columns = dict()
+        self.names = dict()
+        self.history = None
+        self.lock = Lock()
+
+    def update(self, thing_id, readings, timestamp=None):
+        """Store the latest readings of a thing.
+
+        Parameters
+        ----------
+        thing_id : str
+            Primary key of the thing that sent the readings
+
+        readings : list
+            List of dictionaries defined as {sensor_name, sensor_type, sensor_pin, sensor_value}
+
+        timestamp : float
+            Epoch seconds of the readings. Defaults to now
+
+        """
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        with self.lock:
+            for reading in readings:
+                key = (thing_id, reading['sensor_name'], reading['sensor_type'])
+                position = self.slots.get(key)
+
+                if position is None:  # First reading of this sensor
+                    column = self.columns.get(key[2])
+                    if column is None:
+                        column = self.columns[key[2]] = Column(self.capacity)
+                    position = self.slots[key] = column.add(key)
+                    self.names.setdefault(key[1], []).append((key[2], position))
+
+                column = self.columns[key[2]]
+                try:
+                    column.values[position] = float(reading['sensor_value'])
+                except (TypeError, ValueError):  # Unreadable sensor
+                    column.values[position] = np.nan
+                column.timestamps[position] = timestamp
+
+        if self.history is not None:
+            self.history.record(thing_id, readings, timestamp)
+
+        if self.parent is not None:
+            self.parent.update(thing_id, readings, timestamp)
+
+    def column(self, condition_check, field='values'):
+        """Returns the values (or timestamps) of a specific sensor (name with digits) or a type of sensor.
+
+        A type of sensor returns a view of the live array. A specific sensor returns a small copy.
+        """
+
+        if any(char.isdigit() for char in condition_check):
+            return np.array([getattr(self.columns[sensor_type], field)[position]
+                             for sensor_type, position in self.names.get(condition_check, [])], dtype=float)
+
+        column = self.columns.get(condition_check)
+        if column is None:
+            return np.empty(0)
+        return getattr(column, field)[:column.size]
+
+    def timestamps(self, condition_check):
+        """Returns the reading times of a specific sensor or a type of sensor."""
+
+        return self.column(condition_check, field='timestamps')
+
+    def frame(self):
+        """Returns the current state as a pandas data frame."""
+
+        rows = []
+        for sensor_type in self.columns:
+            column = self.columns[sensor_type]
+            for position in range(column.size):
+                thing_id, sensor_name, sensor_type = column.keys[position]
+                rows.append({'thing_id': thing_id, 'sensor_name': sensor_name, 'sensor_type': sensor_type,
+                             'sensor_value': column.values[position], 'timestamp': column.timestamps[position]})
+        return pd.DataFrame(rows)
+
+    @property
+    def empty(self):
+        return len(self.slots) == 0
+
+    def __len__(self):  # Number of sensors tracked
+        return len(self.slots)
+
+    def __repr__(self):
+        return repr(self.frame())
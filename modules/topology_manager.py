@@ -0,0 +1,182 @@
+import os
+import time
+
+import pandas as pd
+
+DEVICES = ('select :home_id '
+           'union select room_id from rooms where home_id = :home_id '
+           'union select thing_id from things where room_id in (select room_id from rooms where home_id = :home_id)')
+
+QUERIES = {  # {table: query for a single home}
+    'homes': 'select * from homes where home_id = :home_id',
+    'rooms': 'select * from rooms where home_id = :home_id',
+    'things': 'select * from things where room_id in (select room_id from rooms where home_id = :home_id)',
+    'rules': 'select * from rules where device_id in ({})'.format(DEVICES),
+    'conditions': 'select * from conditions where rule_id in '
+                  '(select rule_id from rules where device_id in ({}))'.format(DEVICES),
+    'commands': 'select * from commands where device_id in ({})'.format(DEVICES),
+    'mosquitto_channels': 'select * from mosquitto_channels',
+}
+
+
+class Topology:
+    """Every configuration table of the home, read once and indexed in memory.
+
+    Home, Room and Thing take their slice from here instead of querying the database per device.
+
+    Attributes
+    ----------
+    tables : dict
+        Dictionary defined as {table_name: DataFrame}
+
+    source : str
+        Where the tables came from, database or snapshot
+
+    Parameters
+    ----------
+    database : object
+        Object of type Database
+
+    home_id : str
+        Primary key of the home to load
+
+    snapshot : str
+        Optional path of an on-disk copy of the tables. Written after every database load
+
+    prefer_snapshot : bool
+        Load from the snapshot when it exists (fast restart). The snapshot is always used when the database is down
+
+    """
+
+    def __init__(self, database, home_id, snapshot=None, prefer_snapshot=False):
+        self.database = database
+        self.home_id = home_id
+        self.snapshot = snapshot
+        self.prefer_snapshot = prefer_snapshot
+        self.tables = dict()
+        self.source = None
+        self.index = dict()
+
+    def load(self, prefer_snapshot=None):
+        """Read all tables and build the indexes. Returns self.
+
+        Parameters
+        ----------
+        prefer_snapshot : bool
+            Overrides the instance setting, i.e. False to force a database read on reload
+
+        """
+
+        started = time.perf_counter()
+        has_snapshot = self.snapshot is not None and os.path.exists(self.snapshot)
+        if prefer_snapshot is None:
+            prefer_snapshot = self.prefer_snapshot
+
+        if prefer_snapshot and has_snapshot:
+            self.tables, self.source = pd.read_pickle(self.snapshot), 'snapshot'
+        else:
+            try:
+                self.tables = {table: self.database.query(QUERIES[table], {'home_id': self.home_id}, cache=True)
+                               for table in QUERIES}
+                self.source = 'database'
+                if self.snapshot is not None:
+                    pd.to_pickle(self.tables, self.snapshot)
+            except Exception as error:  # Database unreachable, run from the last snapshot
+                if not has_snapshot:
+                    raise
+                print('Database unavailable ({}). Loading snapshot {}'.format(error, self.snapshot))
+                self.tables, self.source = pd.read_pickle(self.snapshot), 'snapshot'
+
+        self.build()
+        print('Topology loaded from {} in {:.1f} ms'.format(self.source, (time.perf_counter() - started) * 1000))
+        return self
+
+    def build(self):
+        """Index every table by the key the nodes look it up with."""
+
+        rules = self.tables['rules']
+        conditions = self.tables['conditions']
+        if not conditions.empty:  # Conditions belong to the device of their rule
+            conditions = conditions.merge(rules[['rule_id', 'device_id']], on='rule_id')
+
+        self.index = {
+            'rules': self.group(rules, 'device_id'),
+            'conditions': self.group(conditions, 'device_id'),
+            'commands': self.group(self.tables['commands'], 'device_id'),
+            'homes': self.records(self.tables['homes'], 'home_id'),
+            'rooms': self.records(self.tables['rooms'], 'room_id'),
+            'things': self.records(self.tables['things'], 'thing_id'),
+            'home_rooms': self.members(self.tables['rooms'], 'home_id', 'room_id'),
+            'room_things': self.members(self.tables['things'], 'room_id', 'thing_id'),
+            'channels': self.members(self.tables['mosquitto_channels'], ['info_level', 'channel_type'],
+                                     'channel_broadcast'),
+        }
+
+    @staticmethod
+    def group(frame, key):
+        """Returns {key: DataFrame slice}. Missing keys are served an empty frame with the same columns."""
+
+        if frame.empty or key not in frame:
+            return {None: frame.iloc[0:0]}
+
+        groups = {value: group.reset_index(drop=True) for value, group in frame.groupby(key)}
+        groups[None] = frame.iloc[0:0]
+        return groups
+
+    @staticmethod
+    def records(frame, key):
+        """Returns {key: row as dictionary}."""
+
+        return {record[key]: record for record in frame.to_dict(orient='records')}
+
+    @staticmethod
+    def members(frame, key, value):
+        """Returns {key: list of values}."""
+
+        members = dict()
+        for record in frame.to_dict(orient='records'):
+            group = tuple(record[k] for k in key) if isinstance(key, list) else record[key]
+            members.setdefault(group, []).append(record[value])
+        return members
+
+    def rules(self, device_id):
+        return self.index['rules'].get(device_id, self.index['rules'][None])
+
+    def conditions(self, device_id):
+        return self.index['conditions'].get(device_id, self.index['conditions'][None])
+
+    def commands(self, device_id):
+        return self.index['commands'].get(device_id, self.index['commands'][None])
+
+    def home(self, home_id):
+        return self.index['homes'][home_id]
+
+    def room(self, room_id):
+        return self.index['rooms'][room_id]
+
+    def thing(self, thing_id):
+        return self.index['things'][thing_id]
+
+    def rooms(self, home_id):
+        """Returns the room IDs of a home."""
+        return self.index['home_rooms'].get(home_id, [])
+
+    def things(self, room_id):
+        """Returns the thing IDs of a room."""
+        return self.index['room_things'].get(room_id, [])
+
+    def channels(self, info_level, channel_types, room_name=None, thing_name=None):
+        """Returns the mosquitto channels for a level and channel types, with room and thing names filled in."""
+
+        if isinstance(channel_types, str):
+            channel_types = [channel_types]
+
+        channels = []
+        for channel_type in channel_types:
+            channels += self.index['channels'].get((info_level, channel_type), [])
+
+        if room_name is not None:
+            channels = [channel.replace('room_name', room_name.replace(' ', '_').lower()) for channel in channels]
+        if thing_name is not None:
+            channels = [channel.replace('thing_name', thing_name.replace(' ', '_').lower()) for channel in channels]
+        return channels